@@ -0,0 +1,122 @@
+"""Benchmark of the chat history query before and after the (author, timestamp) index and SQL-side limit.
+
+Fills a temporary chat db with random messages, times the old query (full timeframe scan, sliced in Python) on the
+unmigrated schema, applies the chat db migrations and times the bound query of ChatStore on the chat db thread.
+
+Usage, from the repository root:
+    python scripts/bench_chat_history.py --rows 2000000 --authors 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from database.chat_db import CHAT_DB_PRAGMAS, ChatStore, create_chat_table  # noqa: E402
+from database.helper_db import open_connection  # noqa: E402
+
+OLD_QUERY = """SELECT role, message
+        FROM chat
+        WHERE author = ? AND timestamp > datetime('now', ?)
+        ORDER BY timestamp ASC;
+    """
+
+
+def fill_db(db_file_path: str, rows: int, authors: int, days: int) -> None:
+    """Insert random messages of random authors, spread over the last days"""
+    conn = open_connection(db_file_path=db_file_path, pragmas=CHAT_DB_PRAGMAS)
+    create_chat_table(connection=conn)
+    now = datetime.now(timezone.utc)
+    batch = []
+    for i in range(rows):
+        # author 0 is a hot author with many more messages than the others
+        author = "author-0" if i % 50 == 0 else f"author-{random.randrange(1, authors)}"
+        timestamp = (now - timedelta(seconds=random.uniform(0, days * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+        batch.append((author, random.choice(("user", "assistant")), "message " * random.randint(1, 40), timestamp))
+        if len(batch) == 50000:
+            conn.executemany("INSERT INTO chat(author,role,message,timestamp) VALUES(?,?,?,?)", batch)
+            conn.commit()
+            batch = []
+    conn.executemany("INSERT INTO chat(author,role,message,timestamp) VALUES(?,?,?,?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def time_calls(func, repeat: int) -> float:
+    """Median duration of func in ms"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def bench_old(db_file_path: str, timeframe: float, limit: int, repeat: int) -> dict:
+    """Time the old query, which returns the whole timeframe and is sliced in Python"""
+    conn = open_connection(db_file_path=db_file_path, pragmas=CHAT_DB_PRAGMAS)
+    results = {}
+    for name, author in (("hot author", "author-0"), ("cold author", "author-1")):
+        results[name] = time_calls(
+            lambda: conn.execute(OLD_QUERY, (author, f"-{timeframe} hours")).fetchall()[-limit:], repeat
+        )
+    conn.close()
+    return results
+
+
+async def bench_new(db_file_path: str, timeframe: float, limit: int, repeat: int) -> tuple:
+    """Migrate the db and time the bound history query on the chat db thread"""
+    store = ChatStore(db_file_path=db_file_path)
+    start = time.perf_counter()
+    await store.open()
+    migration = time.perf_counter() - start
+
+    results = {}
+    for name, author in (("hot author", "author-0"), ("cold author", "author-1")):
+        results[name] = await store._run(
+            time_calls, lambda: store._get_history(author, timeframe, limit), repeat
+        )
+    results["hot author, 90 day timeframe"] = await store._run(
+        time_calls, lambda: store._get_history("author-0", 90 * 24, limit), repeat
+    )
+    await store.close()
+    return migration, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000, help="nr of messages in the chat db")
+    parser.add_argument("--authors", type=int, default=5000, help="nr of authors")
+    parser.add_argument("--days", type=int, default=30, help="messages are spread over the last n days")
+    parser.add_argument("--timeframe", type=float, default=2, help="history timeframe in hours")
+    parser.add_argument("--limit", type=int, default=5, help="nr of messages of the history")
+    parser.add_argument("--repeat", type=int, default=20, help="calls per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file_path = os.path.join(tmp_dir, "chat.db")
+        start = time.perf_counter()
+        fill_db(db_file_path, rows=args.rows, authors=args.authors, days=args.days)
+        duration = time.perf_counter() - start
+        print(f"filled chat db with {args.rows} messages of {args.authors} authors in {duration:.1f}s")
+
+        old = bench_old(db_file_path, timeframe=args.timeframe, limit=args.limit, repeat=args.repeat)
+        migration, new = asyncio.run(
+            bench_new(db_file_path, timeframe=args.timeframe, limit=args.limit, repeat=args.repeat)
+        )
+
+    print(f"migrations (index, token backfill, vacuum) took {migration:.1f}s")
+    print(f"{'median per call':<32} {'before':>10} {'after':>10}")
+    for name, after in new.items():
+        before = f"{old[name]:.3f}ms" if name in old else "-"
+        print(f"{name:<32} {before:>10} {after:>8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
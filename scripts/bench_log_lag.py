@@ -0,0 +1,166 @@
+"""Benchmark of the event loop lag caused by logging, before and after the queue listener, sampling and log levels.
+
+A timer task measures how late the loop wakes it up, while a task on the same loop logs a burst of discord.gateway
+DEBUG, discord.http DEBUG and INFO records every millisecond. Runs the old setup (file handler on the loop), the
+queue listener without sampling and the queue listener with the sampling and levels of conf/config.yaml. With
+--write-delay, every written record blocks its thread to simulate a slow or contended disk.
+
+Usage, from the repository root:
+    python scripts/bench_log_lag.py --duration 5 --write-delay 0.2
+"""
+import argparse
+import asyncio
+import logging
+import logging.handlers
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from utils.setup import CorrelationIdFilter, LocalQueueHandler, SampleFilter  # noqa: E402
+
+LOGGERS = ("discord.gateway", "discord.http", "discord.client")
+
+
+def slow_down(handler: logging.Handler, write_delay: float) -> logging.Handler:
+    """Make every record written by the handler block its thread for write_delay seconds"""
+    if write_delay > 0:
+        emit = handler.emit
+
+        def slow_emit(record: logging.LogRecord) -> None:
+            time.sleep(write_delay)
+            emit(record)
+
+        handler.emit = slow_emit  # type: ignore
+    return handler
+
+
+def setup_old(log_path: str, config_params: dict, write_delay: float) -> list:
+    """Old setup, a file handler on the root logger writing on the logging thread"""
+    handler = slow_down(logging.FileHandler(filename=log_path, encoding="utf-8", mode="w"), write_delay)
+    handler.setFormatter(logging.Formatter("%(asctime)s: %(levelname)s :%(name)s - %(message)s"))
+    logging.getLogger().addHandler(handler)
+    return [handler.close]
+
+
+def setup_queue(log_path: str, config_params: dict, write_delay: float, sample: bool = False) -> list:
+    """Queue handler on the root logger and a listener thread writing to a rotating file, like log_setup"""
+    handler = slow_down(
+        logging.handlers.RotatingFileHandler(filename=log_path, maxBytes=10 * 1024 * 1024, encoding="utf-8"),
+        write_delay,
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s: %(levelname)s :%(name)s - [%(correlation_id)s] %(message)s"))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    if sample:
+        queue_handler.addFilter(
+            SampleFilter(name_prefix="discord.gateway", level=logging.DEBUG,
+                         every_n=config_params["log_gateway_sample"])
+        )
+        for logger_name, level in config_params["log_levels"].items():
+            logging.getLogger(logger_name).setLevel(level)
+    queue_handler.addFilter(CorrelationIdFilter())
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    logging.getLogger().addHandler(queue_handler)
+    return [listener.stop, handler.close]
+
+
+def teardown(cleanups: list) -> None:
+    """Remove the handlers of the root logger and reset logger levels"""
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    for cleanup in cleanups:
+        cleanup()
+    for logger_name in LOGGERS:
+        logging.getLogger(logger_name).setLevel(logging.NOTSET)
+
+
+async def measure(duration: float, timer_interval: float, log_interval: float, burst: tuple) -> dict:
+    """Run the timer and logging tasks for duration seconds
+
+    Returns:
+        dict: lag mean, p99 and max in ms and the mean cost per log call on the loop in us
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + duration
+    gateway, http, client = (logging.getLogger(name) for name in LOGGERS)
+    lags: list[float] = []
+    costs: list[float] = []
+
+    async def timer() -> None:
+        while loop.time() < end:
+            expected = loop.time() + timer_interval
+            await asyncio.sleep(timer_interval)
+            lags.append(max(0.0, loop.time() - expected) * 1000)
+
+    async def log() -> None:
+        n_gateway, n_http, n_info = burst
+        i = 0
+        while loop.time() < end:
+            start = time.perf_counter()
+            for _ in range(n_gateway):
+                gateway.debug("Received WebSocket event %s, sequence %d.", "PRESENCE_UPDATE", i)
+            for _ in range(n_http):
+                http.debug("GET https://discord.com/api/v10/users/@me with None has returned %d", 200)
+            for _ in range(n_info):
+                client.info("Handled interaction %d.", i)
+            costs.append((time.perf_counter() - start) * 1e6 / sum(burst))
+            i += 1
+            await asyncio.sleep(log_interval)
+
+    await asyncio.gather(timer(), log())
+    lags.sort()
+    return {
+        "mean": statistics.fmean(lags),
+        "p99": lags[int(len(lags) * 0.99)],
+        "max": lags[-1],
+        "cost": statistics.fmean(costs),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5, help="seconds per variant")
+    parser.add_argument("--timer-interval", type=float, default=5, help="ms between lag measurements")
+    parser.add_argument("--log-interval", type=float, default=1, help="ms between log bursts")
+    parser.add_argument("--burst", type=int, nargs=3, default=(40, 5, 1), metavar=("GATEWAY", "HTTP", "INFO"),
+                        help="gateway debug, http debug and info records per burst")
+    parser.add_argument("--write-delay", type=float, default=0, help="ms every written record blocks its thread")
+    parser.add_argument("--config", default="./conf/config.yaml", help="config with log_levels and log_gateway_sample")
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config_params = yaml.safe_load(config_file)
+    logging.getLogger().setLevel(logging.DEBUG)
+    variants = (
+        ("old FileHandler", setup_old),
+        ("queue, no sampling", setup_queue),
+        ("queue + config", lambda *a: setup_queue(*a, sample=True)),
+    )
+
+    print(f"{'variant':<22} {'lag mean':>10} {'p99':>8} {'max':>8} {'cost per log call on loop':>27}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, setup in variants:
+            cleanups = setup(os.path.join(tmp_dir, "discord.log"), config_params, args.write_delay / 1000)
+            try:
+                result = asyncio.run(
+                    measure(args.duration, args.timer_interval / 1000, args.log_interval / 1000, tuple(args.burst))
+                )
+            finally:
+                teardown(cleanups)
+            print(
+                f"{name:<22} {result['mean']:>8.1f}ms {result['p99']:>6.1f}ms {result['max']:>6.1f}ms "
+                f"{result['cost']:>25.0f}us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,19 @@
+import hashlib
+import json
 import logging
+import os
+import time
 from datetime import datetime
 
 import discord
-from discord.ext import commands
+from database.chat_db import ChatStore
+from discord.ext import commands, tasks
+from discord import app_commands
+from utils.api_client import ApiClient
+from utils.helpers import record_command_latency
+from utils.loop_monitor import LoopMonitor
+from utils.metrics import Metrics, start_metrics_server
+from utils.rate_limit import RateLimiter
 
 logger = logging.getLogger(__name__)
 
@@ -29,33 +40,200 @@ class MyBot(commands.Bot):
         self.config_params = config_params
         self.is_docker = is_docker
         self.initial_extensions = initial_extensions
+        # latency histograms per command and upstream API
+        self.metrics = Metrics()
+        self.metrics_runner = None
+        # rate limits per upstream API and per user
+        self.rate_limiter = RateLimiter(
+            upstream=config_params["rate_limit_upstream"],
+            user=config_params["rate_limit_user"],
+            upstream_max_wait=config_params["rate_limit_upstream_max_wait"],
+            user_max_wait=config_params["rate_limit_user_max_wait"],
+        )
+        # shared HTTP client for outbound API calls, session is started in setup_hook
+        self.api_client = ApiClient(
+            timeout=config_params["http_timeout"],
+            pool_size=config_params["http_pool_size"],
+            pool_size_per_host=config_params["http_pool_size_per_host"],
+            rate_limiter=self.rate_limiter,
+            retries=config_params["http_retries"],
+            retry_backoff=config_params["http_retry_backoff"],
+            retry_backoff_max=config_params["http_retry_backoff_max"],
+            failure_threshold=config_params["http_circuit_failure_threshold"],
+            reset_timeout=config_params["http_circuit_reset_timeout"],
+            metrics=self.metrics,
+        )
+        # store for chat history for GPT, connection is opened in setup_hook
+        self.chat_store = ChatStore(
+            db_file_path=config_params["chat_db_path"],
+            write_batch_size=config_params["chat_db_write_batch_size"],
+            write_interval=config_params["chat_db_write_interval_ms"] / 1000,
+            write_queue_size=config_params["chat_db_write_queue_size"],
+            history_size=config_params["chat_history_max_messages"],
+            history_cache_users=config_params["chat_history_cache_users"],
+        )
+        # in-process caches registered by cogs, used for owner stats
+        self.caches = {"chat_history": self.chat_store}
+        # watchdog of the event loop, started in setup_hook if enabled
+        self.loop_monitor = None
+        if config_params["loop_monitor_interval"]:
+            self.loop_monitor = LoopMonitor(
+                interval=config_params["loop_monitor_interval"],
+                threshold=config_params["loop_lag_threshold"],
+                alert_after=config_params["loop_lag_alert_after"],
+                alert_cooldown=config_params["loop_lag_alert_cooldown"],
+                on_alert=self.send_owner_message,
+            )
+        # bot owner, fetched on first use
+        self.owner: discord.User | None = None
 
     async def setup_hook(self):
-        """Hook to run after bot is ready, including loading extensions and syncing commands to a specified guild.
+        """Hook to run after bot is ready, including loading extensions and syncing commands if they changed. Logs
+        the duration of each start up phase.
         """
+        # start of each phase, durations are logged once all are done
+        phases = [("start", time.perf_counter())]
+
+        # watch the event loop for blocking callbacks from the start
+        if self.loop_monitor is not None:
+            self.loop_monitor.start()
+        # start HTTP client session prior to loading extensions, as cogs use it for their API calls
+        await self.api_client.start()
+        phases.append(("http client", time.perf_counter()))
+        # open chat db connection, database and relevant tables are created if not existent
+        await self.chat_store.open()
+        phases.append(("chat db", time.perf_counter()))
+        # start periodic retention and compaction of the chat db
+        self.chat_db_maintenance.change_interval(hours=self.config_params["chat_db_maintenance_hours"])
+        self.chat_db_maintenance.start()
+        # optional local metrics endpoint
+        if self.config_params["metrics_port"]:
+            self.metrics_runner = await start_metrics_server(
+                metrics=self.metrics,
+                caches=self.caches,
+                host=self.config_params["metrics_host"],
+                port=self.config_params["metrics_port"],
+            )
+            phases.append(("metrics server", time.perf_counter()))
+
         # loading extensions prior to sync to ensure we are syncing interactions defined in those extensions.
         logger.debug("Loading extensions...")
         for extension in self.initial_extensions:
             await self.load_extension(extension)
-        
-        # Synchronize the app commands to a single guild:
-        # Instead of specifying a guild to every command, we copy over our global commands instead.
-        # By doing so, we don't have to wait up to an hour until they are shown to the end-user.
-        guild = discord.Object(self.KEYS["SERVER_ID"])
-        # copy in the global commands
-        self.tree.copy_global_to(guild=guild)
-        # syncing to guild
-        # await self.tree.sync(guild=guild)
-        # syncing to global
-        await self.tree.sync()
+            phases.append((extension, time.perf_counter()))
+
+        # commands are synced globally, only if they changed since the last sync as syncing is rate limited
+        sync_result = await self.sync_command_tree()
+        phases.append((f"command sync ({sync_result})", time.perf_counter()))
+
+        durations = ", ".join(f"{name} {end - start:.2f}s" for (_, start), (name, end) in zip(phases, phases[1:]))
+        logger.info("Start up took %.2fs: %s", phases[-1][1] - phases[0][1], durations)
+
+    def command_tree_hash(self) -> str:
+        """Hash the global app commands as they are sent to discord on sync, together with the application id.
+
+        Returns:
+            str: hex digest of the command tree
+        """
+        payload = {
+            "application_id": self.application_id,
+            "commands": [command.to_dict(self.tree) for command in self.tree.get_commands()],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def sync_command_tree(self) -> str:
+        """Sync the global app commands if their hash differs from the one persisted at the last sync. A failed sync
+        is logged and retried on the next start.
+
+        Returns:
+            str: "synced", "unchanged" if the sync was skipped or "failed"
+        """
+        hash_path = self.config_params["command_tree_hash_path"]
+        tree_hash = self.command_tree_hash()
+        try:
+            with open(hash_path, encoding="utf-8") as f:
+                synced_hash = f.read().strip()
+        except FileNotFoundError:
+            synced_hash = None
+
+        if tree_hash == synced_hash:
+            logger.info("Command tree unchanged since last sync, sync skipped.")
+            return "unchanged"
+
+        try:
+            synced = await self.tree.sync()
+        except discord.HTTPException as e:
+            logger.error("Command tree not synced: %r", e)
+            return "failed"
+        logger.info("Command tree synced: %s commands.", len(synced))
+
+        os.makedirs(os.path.dirname(hash_path) or ".", exist_ok=True)
+        with open(hash_path, "w", encoding="utf-8") as f:
+            f.write(tree_hash)
+        return "synced"
+
+    async def close(self):
+        """Stop chat db maintenance and loop monitor, shut down the bot and close HTTP client session and chat db
+        connection.
+        """
+        self.chat_db_maintenance.cancel()
+        if self.loop_monitor is not None:
+            await self.loop_monitor.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        # unload cogs and close the gateway first, so no interaction uses the client or chat db once they are closed
+        await super().close()
+        await self.api_client.close()
+        await self.chat_store.close()
+
+    @tasks.loop(hours=24)
+    async def chat_db_maintenance(self):
+        """Archive and delete chat messages older than the retention and compact the chat db.
+        """
+        try:
+            result = await self.chat_store.maintain(
+                retention_days=self.config_params["chat_db_retention_days"],
+                archive_dir=self.config_params["chat_db_archive_dir"],
+            )
+        except Exception as e:
+            logger.error("Chat db maintenance failed: %r", e)
+            return
+
+        logger.info(
+            "Chat db maintenance: %s messages deleted (%s archived), %.1f KiB reclaimed in %.2fs.",
+            result["deleted"], result["archived"], result["reclaimed_bytes"] / 1024, result["duration"],
+        )
+
+    async def on_app_command_completion(self, ctx: discord.Interaction, command: app_commands.Command):
+        """Hook to run after an app command completed successfully, recording its latency.
+        """
+        record_command_latency(ctx)
 
     async def on_ready(self):
         """Hook to run after bot is ready, including messaging server owner.
         """
-        logger.debug(f"Running in docker: {self.is_docker}")
+        logger.debug("Running in docker: %s", self.is_docker)
         if self.user:
-            logger.info(f"Logged in as {self.user.name} - {self.user.id}")
+            logger.info("Logged in as %s - %s", self.user.name, self.user.id)
 
         # message server owner
-        owner = await self.fetch_user(int(self.KEYS["BOT_OWNER_ID"]))
-        await owner.send(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Bot is ready!")
+        await self.send_owner_message("Bot is ready!")
+
+    async def fetch_owner(self) -> discord.User:
+        """Fetch the bot owner once and reuse it afterwards.
+
+        Returns:
+            discord.User: bot owner
+        """
+        if self.owner is None:
+            self.owner = await self.fetch_user(int(self.KEYS["BOT_OWNER_ID"]))
+        return self.owner
+
+    async def send_owner_message(self, message: str) -> None:
+        """Send a direct message with the current time to the bot owner.
+
+        Args:
+            message (str): message to send
+        """
+        owner = await self.fetch_owner()
+        await owner.send(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
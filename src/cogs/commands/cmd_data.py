@@ -1,12 +1,25 @@
+import asyncio
+import contextvars
+import functools
 import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, Callable
 
+import aiohttp
 import discord
-import requests
-from dateutil import tz
+from database.geocode_db import add_geocode_to_db, get_geocode_from_db
+from database.helper_db import open_connection
+from database.holiday_db import add_holidays_to_db, get_holidays_from_db
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
+from utils.cache import TTLCache
+from utils.coin_index import CoinIndex
 from utils.helpers import extract_command_name, millify, up_down_emoji
+from utils.rate_limit import rate_limit
 
 logger = logging.getLogger(__name__)
 
@@ -23,10 +36,103 @@ class DataCommands(commands.Cog):
         self.bot = bot
         self.config_params = bot.config_params  # type: ignore
         self.KEYS = bot.KEYS  # type: ignore
+        self.api_client = bot.api_client  # type: ignore
+
+        # cache coin data responses, hot coins are served from memory while refreshed in the background
+        self.crypto_cache = TTLCache(
+            name="crypto",
+            ttl=self.config_params["crypto_cache_ttl"],
+            max_size=self.config_params["crypto_cache_max_size"],
+            stale_ttl=self.config_params["crypto_cache_stale_ttl"],
+        )
+        bot.caches[self.crypto_cache.name] = self.crypto_cache  # type: ignore
+        # cache weather forecasts per rounded coordinates, nearby locations share one forecast
+        self.weather_cache = TTLCache(
+            name="weather",
+            ttl=self.config_params["weather_cache_ttl"],
+            max_size=self.config_params["weather_cache_max_size"],
+        )
+        bot.caches[self.weather_cache.name] = self.weather_cache  # type: ignore
+        # local index of the coingecko coin catalogue, loaded and refreshed in the background
+        self.coin_index = CoinIndex()
+        # public holidays per (country, year), backed by the holiday table in the cache db
+        self.holiday_data: dict[tuple[str, int], list] = {}
+        # the cache db connection is only used on its own thread, so sqlite calls never block the event loop
+        self.cache_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-db")
+        self.cache_conn: sqlite3.Connection | None = None
+        # geocode cache counters, a hit saves a bing maps round-trip
+        self.geocode_hits = 0
+        self.geocode_misses = 0
+
+    async def cog_load(self) -> None:
+        """Open the cache db connection and start periodic refresh of the coin index and holiday prefetch when the cog
+        is loaded"""
+        self.cache_conn = await self.helper_run_cache_db(
+            open_connection, db_file_path=self.config_params["cache_db_path"]
+        )
+        self.coin_index_refresh.change_interval(hours=self.config_params["coin_index_refresh_hours"])
+        self.coin_index_refresh.start()
+        self.holiday_prefetch.start()
+
+    async def cog_unload(self) -> None:
+        """Stop background tasks and close cache db connection when the cog is unloaded"""
+        self.coin_index_refresh.cancel()
+        self.holiday_prefetch.cancel()
+        if self.cache_conn is not None:
+            await self.helper_run_cache_db(self.cache_conn.close)
+            self.cache_conn = None
+        self.cache_db_executor.shutdown(wait=True)
+
+    async def helper_run_cache_db(self, func: Callable, **kwargs) -> Any:
+        """Run a function on the cache db thread in a copy of the current context, so its logs keep the correlation id
+
+        Args:
+            func (Callable): function to run
+
+        Returns:
+            return value of the function
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.cache_db_executor, functools.partial(context.run, func, **kwargs))
 
     # >>> CRYPTO <<< #
+    @tasks.loop(hours=24)
+    async def coin_index_refresh(self) -> None:
+        """Loads the persisted coin catalogue on start up and refreshes it from coingecko API if outdated"""
+        index_path = self.config_params["coin_index_path"]
+        refresh_hours = self.config_params["coin_index_refresh_hours"]
+
+        # on start up, use persisted catalogue and only fetch a new one if it is outdated
+        if not self.coin_index and os.path.exists(index_path):
+            try:
+                self.coin_index = await asyncio.to_thread(CoinIndex.load, index_path)
+                if (time.time() - os.path.getmtime(index_path)) / 3600 < refresh_hours:
+                    return
+            except (OSError, ValueError) as error:
+                logger.error("Coin index not loaded from %s: %r", index_path, error)
+
+        try:
+            status, coins = await self.api_client.get_json("https://api.coingecko.com/api/v3/coins/list", timeout=60)
+        except (aiohttp.ClientError, TimeoutError) as error:
+            logger.error("Error in coin list request: %r", error)
+            return
+
+        if status != 200 or not isinstance(coins, list):
+            logger.error("Error in coin list response: status %s", status)
+            return
+
+        # build index off the event loop, it takes a moment for the full catalogue
+        coin_index = await asyncio.to_thread(CoinIndex, coins)
+        try:
+            await asyncio.to_thread(coin_index.save, index_path)
+        except OSError as error:
+            logger.error("Coin index not saved to %s: %r", index_path, error)
+        self.coin_index = coin_index
+
     @app_commands.command(name="crypto", description="Get price for a crypto currency.")
-    @app_commands.describe(coin="The crypto currency to get price data for, e.g. 'Bitcoin'.")
+    @app_commands.describe(coin="The crypto currency to get price data for, e.g. 'Bitcoin' or 'BTC'.")
+    @rate_limit()
     async def crypto(self, ctx: discord.Interaction, coin: str) -> None:
         """Get market data for a crypto currency.
 
@@ -37,13 +143,29 @@ class DataCommands(commands.Cog):
         _ = extract_command_name(ctx, logger)
 
         await ctx.response.defer(thinking=True)
-        response = self.helper_get_crypto_data(_coin=coin)
+        response = await self.helper_get_crypto_data(_coin=coin)
 
-        logger.info(f"Sending crypto data for {coin}")
+        logger.info("Sending crypto data for %s", coin)
         await ctx.followup.send(response, ephemeral=True if ctx.guild else False)
 
-    def helper_get_crypto_data(self, _coin: str) -> str:
-        """Gets crypto data from coingecko API
+    @crypto.autocomplete("coin")
+    async def crypto_autocomplete(self, ctx: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+        """Suggest coins from the local coin index while typing.
+
+        Args:
+            ctx (discord.Interaction): discord context
+            current (str): current user input
+
+        Returns:
+            list: coin choices with coin name as label and coingecko id as value
+        """
+        return [
+            app_commands.Choice(name=f"{coin['name']} ({coin['symbol'].upper()})"[:100], value=coin["id"])
+            for coin in self.coin_index.suggest(current, limit=25)
+        ]
+
+    async def helper_get_crypto_data(self, _coin: str) -> str:
+        """Gets crypto data from cache or coingecko API
 
         Args:
             _coin (str): crypto currency name
@@ -52,39 +174,107 @@ class DataCommands(commands.Cog):
 
         Returns:
             str: Message with crypto data or error message
-
-        TODO: update to search by coin symbol
         """
-
-        # define variables for API call
-        coin_id = _coin.lower()
         message_error = "I can't find your currency, are you sure it is correct?"
-        coin_data_url = (
-            f"https://api.coingecko.com/api/v3/coins/{coin_id}"
-            "/?localization=false&tickers=false&market_data=true&community_data=true&developer_data=false"
-        )
-        logger.debug(f"crypto request url: {coin_data_url}")
 
-        try:
-            # get coin data from coingecko API and parse to json
-            coin_data_response = requests.get(coin_data_url).json()
-            if "error" in coin_data_response:
-                # if coin not found, return error message
-                logger.error(f"Error in coin data response: {coin_data_response['error']}")
+        # resolve coin id, symbol or name to coingecko id, use raw input while coin index is not loaded yet
+        match_note = ""
+        if self.coin_index:
+            coin_id = self.coin_index.resolve(_coin)
+            if coin_id is None:
+                logger.info("No coin found in coin index for %s", _coin)
                 return message_error
-            logger.info(f"Coin data received for {coin_id}")
+            # a fuzzy match may be another coin than the one meant, so name the matched coin
+            if self.coin_index.lookup(_coin) is None:
+                match_note = self.helper_match_note(coin_id=coin_id, query=_coin)
+        else:
+            coin_id = _coin.lower()
 
-            # create message with coin data
-            message = self.helper_create_crypto_message(
-                coin_id=coin_id,
-                coin_data=coin_data_response,
-            )
-            return message
+        stale_note = ""
+        try:
+            # get coin data from cache or coingecko API
+            coin_data = await self.crypto_cache.get_or_fetch(coin_id, lambda: self.helper_fetch_coin_data(coin_id))
+        except (aiohttp.ClientError, TimeoutError) as error:
+            logger.error("Error in coin data request: %r", error)
+            # serve outdated coin data while coingecko is unavailable
+            stale = self.crypto_cache.get_stale(coin_id)
+            if stale is None:
+                return message_error
+            coin_data, age = stale
+            stale_note = self.helper_stale_note(service="CoinGecko", age=age)
 
-        except requests.exceptions.RequestException as error:
-            logger.error(error)
+        if coin_data is None:
             return message_error
 
+        # create message with coin data
+        message = self.helper_create_crypto_message(
+            coin_id=coin_id,
+            coin_data=coin_data,
+        )
+        return message + match_note + stale_note
+
+    def helper_match_note(self, coin_id: str, query: str) -> str:
+        """Creates a note naming the coin a query was fuzzy matched to
+
+        Args:
+            coin_id (str): coingecko id of the matched coin
+            query (str): user input
+
+        Returns:
+            str: note appended to a message with coin data
+        """
+        coin = self.coin_index.get(coin_id)
+        name = f"{coin['name']} ({coin['symbol'].upper()})" if coin else coin_id
+        return f"\n:mag: *Showing {name} for '{query}'.*"
+
+    def helper_stale_note(self, service: str, age: float) -> str:
+        """Creates a note marking data as outdated
+
+        Args:
+            service (str): name of the unavailable upstream service
+            age (float): age of the data in seconds
+
+        Returns:
+            str: note appended to a message with outdated data
+        """
+        return f"\n:warning: *{service} is unavailable, data is from {age / 60:.0f} minutes ago.*"
+
+    async def helper_fetch_coin_data(self, coin_id: str) -> dict | None:
+        """Fetches coin data from coingecko API
+
+        Args:
+            coin_id (str): coingecko coin id
+
+        Raises:
+            aiohttp.ClientError: if the request fails
+            TimeoutError: if the request times out
+
+        Returns:
+            dict: coin data, None if coin not found
+        """
+        # define variables for API call
+        coin_data_url = f"https://api.coingecko.com/api/v3/coins/{coin_id}"
+        coin_data_params = {
+            "localization": "false",
+            "tickers": "false",
+            "market_data": "true",
+            "community_data": "true",
+            "developer_data": "false",
+        }
+        logger.debug("crypto request url: %s", coin_data_url)
+
+        # get coin data from coingecko API and parse to json
+        status, coin_data_response = await self.api_client.get_json(coin_data_url, params=coin_data_params)
+        # only a 404 means the coin is unknown, other errors must not be cached as coin data
+        if status == 404:
+            logger.error("Error in coin data response: %s", coin_data_response)
+            return None
+        if status != 200 or not isinstance(coin_data_response, dict) or "error" in coin_data_response:
+            raise aiohttp.ClientError(f"Coin data request for {coin_id} failed with status {status}")
+        logger.info("Coin data received for %s", coin_id)
+
+        return coin_data_response
+
     def helper_create_crypto_message(self, coin_id: str, coin_data: dict) -> str:
         """Creates message with crypto data
 
@@ -139,8 +329,19 @@ class DataCommands(commands.Cog):
         return message
 
     # >>> HOLIDAYS <<< #
+    @tasks.loop(hours=24)
+    async def holiday_prefetch(self) -> None:
+        """Prefetches public holidays of the current year for configured countries"""
+        curr_year = datetime.now().year
+        for country_code in self.config_params["holiday_prefetch_countries"]:
+            try:
+                await self.helper_load_holidays(country_code=country_code.upper(), year=curr_year)
+            except (aiohttp.ClientError, TimeoutError) as error:
+                logger.error("Error in holiday prefetch for %s: %r", country_code, error)
+
     @app_commands.command(name="holidays", description="Get public holidays for a country.")
     @app_commands.describe(country="The country code to get public holidays for, e.g. 'DE'.")
+    @rate_limit()
     async def holiday(self, ctx: discord.Interaction, country: str = "DE") -> None:
         """Get a list public holidays of the current year for a country.
 
@@ -151,12 +352,12 @@ class DataCommands(commands.Cog):
         _ = extract_command_name(ctx, logger)
 
         await ctx.response.defer(thinking=True)
-        response = self.helper_get_holiday_data(_country=country)
+        response = await self.helper_get_holiday_data(_country=country)
 
-        logger.info(f"Sending holiday data for {country}")
+        logger.info("Sending holiday data for %s", country)
         await ctx.followup.send(response, ephemeral=True if ctx.guild else False)
 
-    def helper_get_holiday_data(self, _country: str = "DE") -> str:
+    async def helper_get_holiday_data(self, _country: str = "DE") -> str:
         """Get holiday data for a country and create a response message.
 
         Args:
@@ -169,19 +370,16 @@ class DataCommands(commands.Cog):
         # get current year
         curr_year = datetime.now().year
 
-        # get holiday data from country code
-        holiday_data_url = f"https://date.nager.at/api/v3/publicholidays/{curr_year}/{country_code}"
         try:
-            holiday_data_response = requests.get(holiday_data_url)
-            logger.info(f"Holiday data received for {country_code}")
-            logger.debug(holiday_data_response.json())
+            # get holiday data from memory, holiday db or date.nager.at API
+            holiday_data = await self.helper_load_holidays(country_code=country_code, year=curr_year)
 
-            if holiday_data_response.status_code == 404:
+            if holiday_data is None:
                 return "I can't find your country, are you sure it is a correct country code?"
 
             # create response message
             message = f"**Holidays for {country_code}**\n"
-            for holiday in holiday_data_response.json():
+            for holiday in holiday_data:
                 # extract counties from response
                 if holiday["counties"]:
                     counties = ", ".join([county.split("-")[1] for county in holiday["counties"]])
@@ -194,16 +392,61 @@ class DataCommands(commands.Cog):
 
             return message
 
-        except requests.exceptions.RequestException as error:
-            logger.error(error)
-            return "I can't find your country, are you sure it is a correct country code?"
+        except (aiohttp.ClientError, TimeoutError) as error:
+            logger.error("Error in holiday data request: %r", error)
+            return "The holiday service is not available right now, please try again later."
         except TypeError as error:
             logger.error(error)
             return "There is something wrong here. Ask the mighty developer to check the logs."
 
+    async def helper_load_holidays(self, country_code: str, year: int) -> list | None:
+        """Get public holidays of a country and year, fetching them from date.nager.at API only on first request.
+
+        Args:
+            country_code (str): upper case country code
+            year (int): year of the holidays
+
+        Raises:
+            aiohttp.ClientError: if the request fails or returns an error other than 404
+            TimeoutError: if the request times out
+
+        Returns:
+            list: holidays as returned by the date.nager.at API, None if country not found
+        """
+        key = (country_code, year)
+        if key in self.holiday_data:
+            return self.holiday_data[key]
+
+        holiday_data = await self.helper_run_cache_db(
+            get_holidays_from_db, country=country_code, year=year, connection=self.cache_conn
+        )
+        if holiday_data is not None:
+            logger.debug("Holiday data for %s:%s loaded from holiday db", country_code, year)
+            self.holiday_data[key] = holiday_data
+            return holiday_data
+
+        # public holidays of a year do not change, so they are fetched once and stored
+        holiday_data_url = f"https://date.nager.at/api/v3/publicholidays/{year}/{country_code}"
+        status, holiday_data = await self.api_client.get_json(holiday_data_url)
+        logger.info("Holiday data received for %s:%s (status %s)", country_code, year, status)
+        logger.debug(holiday_data)
+
+        # only a 404 means the country is unknown, other errors are worth a retry later
+        if status == 404:
+            return None
+        if status != 200 or not isinstance(holiday_data, list):
+            raise aiohttp.ClientError(f"Holiday data request for {country_code}:{year} failed with status {status}")
+
+        await self.helper_run_cache_db(
+            add_holidays_to_db, country=country_code, year=year, holidays=holiday_data, connection=self.cache_conn
+        )
+        self.holiday_data[key] = holiday_data
+        return holiday_data
+
     # >>> WEATHER <<< #
     @app_commands.command(name="weather", description="Get weather data for a location.")
     @app_commands.describe(location="The location to get weather data for, e.g. 'Berlin'.")
+    @rate_limit()
     async def weather(self, ctx: discord.Interaction, location: str) -> None:
         """Get weather data for a location.
 
@@ -216,19 +459,19 @@ class DataCommands(commands.Cog):
         await ctx.response.defer(thinking=True)
         location = location.title()
         try:
-            response = self.helper_get_weather_info(location=location)
+            response = await self.helper_get_weather_info(location=location)
         except Exception as error:
-            logger.error(f"Error in weather command: {error}")
+            logger.error("Error in weather command: %s", error)
             await ctx.followup.send(
                 "I've run out of carrots, please try again later. :carrot: :no_entry_sign:",
                 ephemeral=True if ctx.guild else False,
             )
             return
 
-        logger.info(f"Sending weather data for {location}")
+        logger.info("Sending weather data for %s", location)
         await ctx.followup.send(response, ephemeral=True if ctx.guild else False)
 
-    def helper_get_weather_info(self, location: str) -> str:
+    async def helper_get_weather_info(self, location: str) -> str:
         """Gets weather info for a location and creates a message
 
         Args:
@@ -239,45 +482,124 @@ class DataCommands(commands.Cog):
         Returns:
             str: message displayed to user with weather conditions for a location
         """
-        # get geolocation data
+        # get geolocation data from geocode cache or bing maps API
         try:
-            geo_url = (
-                f"https://dev.virtualearth.net/REST/v1/Locations?q=" f"{location}&key={self.KEYS['BINGMAPS_API_KEY']}"
-            )
-            geo_response = requests.get(geo_url)
-        except requests.exceptions.RequestException as error:
-            logger.error(error)
+            location, lat, lng = await self.helper_get_geo_data(location=location)
+        except (aiohttp.ClientError, TimeoutError) as error:
+            logger.error("Error in geolocation request: %r", error)
             return "I don't know where that is."
 
-        geo_json = geo_response.json()
-
-        # extract relevant geolocation data
-        location, lat, lng = self.helper_extract_geo_data(geo_json=geo_json)
-
         if lat is None or lng is None:
             return "I don't know where that is."
 
-        # get weather data
+        # get weather data from weather cache or openweathermap API, bucketed by rounded coordinates
+        precision = self.config_params["weather_cache_precision"]
+        bucket = (round(lat, precision), round(lng, precision))
+        stale_note = ""
         try:
-            exclude = "minutely,hourly,alerts"
-            weather_url = (
-                f"https://api.openweathermap.org/data/3.0/onecall?"
-                f"lat={lat}&lon={lng}&exclude={exclude}"
-                f"&appid={self.KEYS['OPENWEATHER_API_KEY']}&units=metric"
+            weather_json = await self.weather_cache.get_or_fetch(
+                bucket, lambda: self.helper_fetch_weather_data(lat=bucket[0], lng=bucket[1])
             )
-            weather_response = requests.get(weather_url)
-        except requests.exceptions.RequestException as error:
-            logger.error(error)
+        except (aiohttp.ClientError, TimeoutError) as error:
+            logger.error("Error in weather request: %r", error)
+            # serve outdated forecast while openweathermap is unavailable
+            stale = self.weather_cache.get_stale(bucket)
+            if stale is None:
+                return "I don't know where that is."
+            weather_json, age = stale
+            stale_note = self.helper_stale_note(service="OpenWeather", age=age)
+
+        if weather_json is None:
             return "I don't know where that is."
 
         # extract relevant weather data
-        weather_json = weather_response.json()
         message = self.helper_create_weather_message(
             weather_json=weather_json,
             location=location,
         )
 
-        return message
+        return message + stale_note
+
+    async def helper_fetch_weather_data(self, lat: float, lng: float) -> dict | None:
+        """Fetches current and daily weather data from openweathermap API
+
+        Args:
+            lat (float): latitude of the location
+            lng (float): longitude of the location
+
+        Raises:
+            aiohttp.ClientError: if the request fails
+            TimeoutError: if the request times out
+
+        Returns:
+            dict: weather data, None if the request was not successful
+        """
+        weather_url = "https://api.openweathermap.org/data/3.0/onecall"
+        weather_params = {
+            "lat": lat,
+            "lon": lng,
+            "exclude": "minutely,hourly,alerts",
+            "appid": self.KEYS["OPENWEATHER_API_KEY"],
+            "units": "metric",
+        }
+        status, weather_json = await self.api_client.get_json(weather_url, params=weather_params)
+        if status != 200 or not weather_json:
+            logger.error("Error in weather response: status %s - %s", status, weather_json)
+            return None
+        logger.info("Weather data received for %s,%s", lat, lng)
+
+        return weather_json
+
+    async def helper_get_geo_data(self, location: str) -> tuple:
+        """Gets geolocation data for a location from geocode cache, geocoding it via bing maps API on a miss
+
+        Args:
+            location (str): location name of weather conditions request
+
+        Raises:
+            aiohttp.ClientError: if the request fails
+            TimeoutError: if the request times out
+
+        Returns:
+            tuple: location name, latitude, longitude
+        """
+        query = " ".join(location.lower().split())
+
+        geo_data = await self.helper_run_cache_db(
+            get_geocode_from_db,
+            query=query,
+            max_age=self.config_params["geocode_cache_ttl_days"],
+            connection=self.cache_conn,
+        )
+        if geo_data is not None:
+            self.geocode_hits += 1
+        else:
+            self.geocode_misses += 1
+        hit_ratio = self.geocode_hits / (self.geocode_hits + self.geocode_misses)
+        logger.info(
+            "Geocode cache %s for %s (hit ratio %.0f%%, %s round-trips saved)",
+            "hit" if geo_data else "miss", query, hit_ratio * 100, self.geocode_hits,
+        )
+        if geo_data is not None:
+            return geo_data
+
+        geo_url = "https://dev.virtualearth.net/REST/v1/Locations"
+        geo_params = {"q": location, "key": self.KEYS["BINGMAPS_API_KEY"]}
+        status, geo_json = await self.api_client.get_json(geo_url, params=geo_params)
+        # only a 404 means the location is unknown, other errors are worth a retry later
+        if status == 404:
+            return location, None, None
+        if status != 200 or not isinstance(geo_json, dict):
+            raise aiohttp.ClientError(f"Geolocation request for {query} failed with status {status}")
+
+        # extract relevant geolocation data
+        location, lat, lng = self.helper_extract_geo_data(geo_json=geo_json)
+        if lat is not None and lng is not None:
+            await self.helper_run_cache_db(
+                add_geocode_to_db, query=query, location=location, lat=lat, lng=lng, connection=self.cache_conn
+            )
+
+        return location, lat, lng
 
     def helper_extract_geo_data(self, geo_json: dict) -> tuple:
         """extracts relevant geolocation data from json
@@ -401,6 +723,9 @@ class DataCommands(commands.Cog):
         Returns:
             str: converted timestamp in format HH:MM
         """
+        # imported on first use to keep it out of the start up
+        from dateutil import tz
+
         from_zone = tz.gettz(from_zone_name)
         to_zone = tz.gettz(to_zone_name)
 
@@ -1,13 +1,21 @@
+import asyncio
+import importlib
+import io
 import logging
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import TYPE_CHECKING
 
+import aiohttp
 import discord
-from openai import OpenAI
-from database.chat_db import add_message_to_chat_db, get_chat_history
-from database.helper_db import open_connection
 from discord import app_commands
 from discord.ext import commands
-from utils.helpers import extract_command_name
+from utils.cache import TTLCache
+from utils.helpers import estimate_tokens, extract_command_name
+from utils.image_cache import ImageCache
+from utils.job_queue import FairJobQueue
+from utils.rate_limit import RateLimited, rate_limit
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -22,14 +30,74 @@ class GenAICommands(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         """Commands cog with NLP based commands such as chatting with GPT, etc."""
         self.bot = bot
-        self.oai_client = OpenAI()
-        self.oai_client.api_key = bot.KEYS["OPENAI_API_KEY"]  # type: ignore
         self.config_params = bot.config_params  # type: ignore
+        self.chat_store = bot.chat_store  # type: ignore
+        self.api_client = bot.api_client  # type: ignore
+        self.rate_limiter = bot.rate_limiter  # type: ignore
+        self.metrics = bot.metrics  # type: ignore
+        # one async client for all calls, so its HTTP connection pool is shared across concurrent users. Created on
+        # first use, as importing openai is slow and not needed until the first genai command.
+        self._oai_client: "AsyncOpenAI | None" = None
+        self.oai_import: asyncio.Task | None = None
         self.error_msg_tired_robot = "OpenAI's robots seem to be very tired. :zzz: Please try again later."
+        # appended to streamed responses cut off by the timeout, on discord and in the chat history
+        self.stream_cut_off_note = "\n\n*(response cut off, OpenAI took too long)*"
+        # running background summarizations per user
+        self.summary_tasks: dict[str, asyncio.Task] = {}
+        # cache responses to identical prompts without chat history, concurrent identical prompts share one call
+        self.response_cache = TTLCache(
+            name="chat_response",
+            ttl=self.config_params["chat_response_cache_ttl"],
+            max_size=self.config_params["chat_response_cache_max_size"],
+        )
+        if self.config_params["chat_response_cache_enabled"]:
+            bot.caches[self.response_cache.name] = self.response_cache  # type: ignore
+        # image generation jobs, limited in concurrency and taking turns across users
+        self.img_queue = FairJobQueue(
+            name="img",
+            concurrency=self.config_params["img_queue_concurrency"],
+            max_jobs_per_owner=self.config_params["img_queue_max_per_user"],
+        )
+        # generated images on disk, repeated prompts are served without a new generation
+        self.img_cache = ImageCache(
+            cache_dir=self.config_params["img_cache_dir"],
+            max_bytes=self.config_params["img_cache_max_mb"] * 1024 * 1024,
+        )
+
+    async def cog_load(self) -> None:
+        """Start the image generation queue and import openai on a thread when the cog is loaded"""
+        self.img_queue.start()
+        # importing openai takes about a second, off the event loop and without delaying start up
+        self.oai_import = asyncio.create_task(asyncio.to_thread(importlib.import_module, "openai"))
+
+    async def cog_unload(self) -> None:
+        """Cancel running summarizations and image jobs and close the OpenAI client and its connection pool when
+        the cog is unloaded"""
+        for task in self.summary_tasks.values():
+            task.cancel()
+        await self.img_queue.close()
+        if self._oai_client is not None:
+            await self._oai_client.close()
+
+    async def helper_get_oai_client(self) -> "AsyncOpenAI":
+        """gets the OpenAI client, created on first use once openai is imported
+
+        Returns:
+            AsyncOpenAI: OpenAI client
+        """
+        if self._oai_client is None:
+            if self.oai_import is not None:
+                # shielded, a cancelled command must not cancel the import for everyone else
+                await asyncio.shield(self.oai_import)
+            from openai import AsyncOpenAI
+
+            self._oai_client = AsyncOpenAI(api_key=self.bot.KEYS["OPENAI_API_KEY"])  # type: ignore
+        return self._oai_client
 
     # >>> chat <<< #
     @app_commands.command(name="chat", description="Chat with totally not a robot.")
     @app_commands.describe(message="Your message to the robot, e.g. 'A poem about...'.")
+    @rate_limit()
     async def chat(self, ctx: discord.Interaction, message: str) -> None:
         """Chat with totally not a robot.
 
@@ -42,19 +110,27 @@ class GenAICommands(commands.Cog):
         await ctx.response.defer(thinking=True)
 
         try:
-            response = self.helper_get_chat_response(
+            if self.config_params["oai_stream"]:
+                # streamed responses are sent while they are generated
+                await self.helper_stream_chat_response(
+                    ctx=ctx,
+                    message=message,
+                )
+                return
+
+            response = await self.helper_get_chat_response(
                 ctx=ctx,
                 message=message,
             )
         except Exception as e:
-            logger.error(f"Error with OpenAI API: {e}")
+            logger.error("Error with OpenAI API: %s", e)
             await ctx.followup.send(self.error_msg_tired_robot)
             return
 
         logger.info("Sending GPT text response.")
         await ctx.followup.send(response)
 
-    def helper_get_chat_response(
+    async def helper_get_chat_response(
         self,
         ctx: discord.Interaction,
         message: str,
@@ -68,57 +144,438 @@ class GenAICommands(commands.Cog):
         Returns:
             str: chat response
         """
-        # open chat db connection
-        chat_conn = open_connection(
-            db_file_path=self.config_params["chat_db_path"],
-        )
+        # add message to chat db and create message context from chat history
+        message_context = await self.helper_get_chat_context(ctx=ctx, message=message)
+
+        async def fetch_response() -> str | None:
+            # use Open AI'S gpt to create an answer, wrapped in a timeout
+            response_oai = await self.helper_oai_chat_call(
+                message_context=message_context,
+                model=self.config_params["oai_model"],
+                max_tokens=self.config_params["oai_max_tokens"],
+                timeout=self.config_params["oai_timeout"],
+            )
+            if response_oai is None:
+                return None
+            usage = response_oai.usage  # type: ignore
+            if usage:
+                logger.info("Chat call for %s used %d prompt tokens.", ctx.user, usage.prompt_tokens)
+            # extract response content
+            return response_oai.choices[0].message.content  # type: ignore
+
+        cache_key = self.helper_response_cache_key(message_context=message_context)
+        if cache_key is None:
+            response = await fetch_response()
+        else:
+            response = await self.response_cache.get_or_fetch(cache_key, fetch_response)
+
+        # check if timeout
+        if response is None:
+            return self.error_msg_tired_robot
+        else:
+            # add response to chat db
+            await self.chat_store.add_message(
+                username=str(ctx.user),
+                message=response,
+                role="assistant",
+            )
+            self.helper_schedule_summary(username=str(ctx.user))
+
+            return response
+
+    async def helper_get_chat_context(self, ctx: discord.Interaction, message: str) -> list:
+        """add user message to chat db and create message context from the user's chat history
+
+        Args:
+            ctx (discord.Interaction): interaction context
+            message (str): message to send to openai
 
+        Returns:
+            list: list of dicts with message context
+        """
         # add message to chat db
-        add_message_to_chat_db(
+        await self.chat_store.add_message(
             username=str(ctx.user),
             message=message,
             role="user",
-            connection=chat_conn,
         )
 
-        # get chat history for user from db
-        chat_history = get_chat_history(
+        # get chat history for user from db, the token budget picks how many of these messages are sent
+        chat_history = await self.chat_store.get_history(
             username=str(ctx.user),
             timeframe=self.config_params["chat_history_timeframe"],
-            connection=chat_conn,
+            limit=self.config_params["chat_history_max_messages"],
+        )
+        summary = None
+        if self.config_params["chat_summary_enabled"]:
+            summary = await self.chat_store.get_summary(
+                username=str(ctx.user),
+                timeframe=self.config_params["chat_history_timeframe"],
+            )
+        if summary is not None:
+            _, summary_tokens, source_tokens = summary
+            logger.info(
+                "Chat summary for %s replaces ~%s with ~%s prompt tokens, saving ~%s tokens.",
+                ctx.user, source_tokens, summary_tokens, source_tokens - summary_tokens,
+            )
+
+        # create message context within token budget
+        message_context = self.helper_build_message_context(chat_history=chat_history, summary=summary)
+        logger.debug("Chat history for %s: %d messages used as context.", ctx.user, len(message_context))
+        return message_context
+
+    def helper_history_token_budget(self, summary: tuple | None = None) -> int:
+        """get the tokens left for chat history messages, after the system prompt, summary and response
+
+        Args:
+            summary (tuple, optional): summary of the earlier conversation and its token count. Defaults to None.
+
+        Returns:
+            int: token budget of the chat history messages
+        """
+        budget = self.config_params["oai_context_token_budget"] - self.config_params["oai_max_tokens"]
+        if self.config_params["oai_system_prompt"]:
+            budget -= estimate_tokens(self.config_params["oai_system_prompt"])
+        if summary is not None:
+            budget -= summary[1]
+        return budget
+
+    def helper_count_fitting_messages(self, tokens: list, budget: int) -> int:
+        """count the latest messages that fit into the token budget, the latest message always counts
+
+        Args:
+            tokens (list): token counts of the messages, oldest message first
+            budget (int): token budget of the messages
+
+        Returns:
+            int: nr of latest messages that fit
+        """
+        count = 0
+        used_tokens = 0
+        for message_tokens in reversed(tokens):
+            if count and used_tokens + message_tokens > budget:
+                break
+            count += 1
+            used_tokens += message_tokens
+        return count
+
+    def helper_build_message_context(self, chat_history: list, summary: tuple | None = None) -> list:
+        """create message context from the latest messages of the chat history that fit into the token budget,
+        which covers the system prompt, summary, history, new message and the tokens reserved for the response
+
+        Args:
+            chat_history (list): list of tuples of role, message and token count, oldest message first and the new
+                user message last
+            summary (tuple, optional): summary of the earlier conversation, its token count and token count of the
+                summarized messages. Defaults to None.
+
+        Returns:
+            list: list of dicts with message context
+        """
+        system_prompt = self.config_params["oai_system_prompt"]
+        budget = self.helper_history_token_budget(summary=summary)
+
+        # the latest messages that fit into the budget, the new user message is always included
+        fitting = self.helper_count_fitting_messages(tokens=[tokens for _, _, tokens in chat_history], budget=budget)
+        recent_history = chat_history[len(chat_history) - fitting:]
+        history_context = [{"role": role, "content": message} for role, message, _ in recent_history]
+        used_tokens = sum(tokens for _, _, tokens in recent_history)
+
+        if used_tokens > budget:
+            logger.warning("New message exceeds token budget: %s of %s tokens.", used_tokens, budget)
+        logger.debug("Message context: %d messages with ~%d of %d tokens.", len(history_context), used_tokens, budget)
+
+        system_context = []
+        if system_prompt:
+            system_context.append({"role": "system", "content": system_prompt})
+        if summary is not None:
+            system_context.append({"role": "system", "content": f"Summary of the earlier conversation: {summary[0]}"})
+        return system_context + history_context
+
+    def helper_response_cache_key(self, message_context: list) -> tuple | None:
+        """create a response cache key of model, parameters and normalized message context, for message contexts
+        with the new user message as their only chat message
+
+        Args:
+            message_context (list): list of dicts with message context
+
+        Returns:
+            tuple: cache key, None if the response cache is disabled or the message context has chat history
+        """
+        if not self.config_params["chat_response_cache_enabled"]:
+            return None
+        if sum(1 for msg in message_context if msg["role"] != "system") != 1:
+            return None
+
+        # case and whitespace do not change the answer to a prompt like "tell me a joke"
+        normalized_context = tuple(
+            (msg["role"], " ".join(msg["content"].split()).casefold()) for msg in message_context
+        )
+        return (self.config_params["oai_model"], self.config_params["oai_max_tokens"], normalized_context)
+
+    def helper_schedule_summary(self, username: str) -> None:
+        """start summarizing the earlier chat history of a user in the background, unless summaries are disabled
+        or a summarization for the user is already running
+
+        Args:
+            username (str): username of the user this conversation is with
+        """
+        if not self.config_params["chat_summary_enabled"] or username in self.summary_tasks:
+            return
+
+        task = asyncio.create_task(self.helper_summarize_history(username=username))
+        self.summary_tasks[username] = task
+        task.add_done_callback(lambda t: self.helper_summary_done(username, t))
+
+    def helper_summary_done(self, username: str, task: asyncio.Task) -> None:
+        """remove a finished summarization and log its error, as no caller awaits it
+
+        Args:
+            username (str): username of the user this conversation is with
+            task (asyncio.Task): finished summarization
+        """
+        self.summary_tasks.pop(username, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Chat summary for %s failed: %r", username, task.exception())
+
+    async def helper_summarize_history(self, username: str) -> None:
+        """summarize messages older than the context window into the rolling summary of a user, once the
+        unsummarized messages exceed the token threshold. The previous summary is folded into the new one.
+
+        Args:
+            username (str): username of the user this conversation is with
+        """
+        timeframe = self.config_params["chat_history_timeframe"]
+        previous = await self.chat_store.get_summary(username=username, timeframe=timeframe)
+        rows = await self.chat_store.get_unsummarized(username=username, timeframe=timeframe, keep_recent=0)
+        # messages sent as they are, as picked by helper_build_message_context, are not summarized
+        keep_recent = min(
+            self.config_params["chat_history_max_messages"],
+            self.helper_count_fitting_messages(
+                tokens=[row[3] for row in rows], budget=self.helper_history_token_budget(summary=previous)
+            ),
         )
-        # filter context length
-        chat_history = chat_history[-self.config_params["chat_history_ctx_length"] :]
-        logger.debug(f"Chat history for {ctx.user}: {len(chat_history)} messages used as context.")
-        # create message context
-        message_context = [{"role": hist[0], "content": hist[1]} for hist in chat_history]
-
-        # use Open AI'S gpt to create an answer, wrapped in a timeout
-        response_oai = self.helper_oai_chat_call(
+        rows = rows[:len(rows) - keep_recent]
+        tokens = sum(row[3] for row in rows)
+        if tokens < self.config_params["chat_summary_threshold_tokens"]:
+            return
+
+        transcript = "\n".join(f"{role}: {message}" for _, role, message, _, _ in rows)
+        if previous is not None:
+            transcript = f"Previous summary: {previous[0]}\n\n{transcript}"
+        message_context = [
+            {
+                "role": "system",
+                "content": "Summarize the following conversation between a user and an assistant in a few "
+                "sentences. Keep facts, names, preferences and open questions needed to continue it.",
+            },
+            {"role": "user", "content": transcript},
+        ]
+
+        response_oai = await self.helper_oai_chat_call(
             message_context=message_context,
-            model=self.config_params["oai_model"],
-            max_tokens=self.config_params["oai_max_tokens"],
+            model=self.config_params["chat_summary_model"],
+            max_tokens=self.config_params["chat_summary_max_tokens"],
+            temperature=0,
             timeout=self.config_params["oai_timeout"],
         )
+        if response_oai is None or not response_oai.choices[0].message.content:  # type: ignore
+            return
 
-        # check if timeout
-        if response_oai is None:
-            return self.error_msg_tired_robot
+        source_tokens = tokens + (previous[2] if previous else 0)
+        await self.chat_store.set_summary(
+            username=username,
+            summary=response_oai.choices[0].message.content,  # type: ignore
+            source_tokens=source_tokens,
+            last_message_id=rows[-1][0],
+            timestamp=rows[-1][4],
+        )
+        logger.info("Summarized %s messages of %s, ~%s tokens summarized in total.", len(rows), username, source_tokens)
+
+    async def helper_stream_chat_response(
+        self,
+        ctx: discord.Interaction,
+        message: str,
+    ) -> None:
+        """query openai api for a streamed chat response and send it while it is generated, editing the followup
+        message in batches and continuing in a new message once the discord message length limit is reached
+
+        Args:
+            ctx (discord.Interaction): interaction context
+            message (str): message to send to openai
+        """
+        # add message to chat db and create message context from chat history
+        message_context = await self.helper_get_chat_context(ctx=ctx, message=message)
+
+        cache_key = self.helper_response_cache_key(message_context=message_context)
+        if cache_key is None:
+            response, _ = await self.helper_stream_completion(ctx=ctx, message_context=message_context)
         else:
-            # extract response content
-            response = response_oai.choices[0].message.content  # type: ignore
+            # the first caller streams the response, concurrent identical prompts and cache hits send it once done
+            streamed = ""
 
-            # add response to chat db
-            add_message_to_chat_db(
-                username=str(ctx.user),
-                message=response,
-                role="assistant",
-                connection=chat_conn,
-            )
+            async def fetch_response() -> str | None:
+                nonlocal streamed
+                streamed, complete = await self.helper_stream_completion(ctx=ctx, message_context=message_context)
+                return streamed if complete and streamed.strip() else None
 
-            return response
+            response = await self.response_cache.get_or_fetch(cache_key, fetch_response)
+            if streamed:
+                response = streamed
+            elif response:
+                await self.helper_stream_render(ctx, response, None, 0)
+
+        if not response or not response.strip():
+            await ctx.followup.send(self.error_msg_tired_robot)
+            return
+
+        logger.info("GPT text response streamed.")
+
+        # add final response to chat db
+        await self.chat_store.add_message(
+            username=str(ctx.user),
+            message=response,
+            role="assistant",
+        )
+        self.helper_schedule_summary(username=str(ctx.user))
+
+    async def helper_stream_completion(self, ctx: discord.Interaction, message_context: list) -> tuple:
+        """stream a chat completion into followup messages, editing them in batches
+
+        Args:
+            ctx (discord.Interaction): interaction context
+            message_context (list): list of dicts with message context
+
+        Returns:
+            tuple: streamed response, False if the stream timed out before it was complete. A response cut off by
+                the timeout ends with a note marking it as incomplete.
+        """
+        edit_interval = self.config_params["oai_stream_edit_interval_ms"] / 1000
+        edit_tokens = self.config_params["oai_stream_edit_tokens"]
+        loop = asyncio.get_running_loop()
+
+        response = ""
+        discord_msg = None  # followup message currently being edited
+        msg_start = 0  # position in response where the current followup message starts
+        pending_tokens = 0
+        last_edit = loop.time()
+        complete = True
+        stream = None
+        # only waiting for openai counts towards the timeout, including its rate limit, while discord edits do not
+        deadline = loop.time() + self.config_params["oai_timeout"]
+
+        try:
+            async with asyncio.timeout_at(deadline):
+                oai_client = await self.helper_get_oai_client()
+                await self.rate_limiter.acquire_upstream("openai")
+                # time to first chunk, streaming itself is paced by the model
+                with self.metrics.timer("upstream", "openai_chat_stream"):
+                    stream = await oai_client.chat.completions.create(
+                        messages=message_context,
+                        model=self.config_params["oai_model"],
+                        max_tokens=self.config_params["oai_max_tokens"],
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+            chunks = aiter(stream)
+            while True:
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    break
+                # usage is sent in a last chunk without choices
+                if chunk.usage:
+                    logger.info("Chat call for %s used %d prompt tokens.", ctx.user, chunk.usage.prompt_tokens)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if not response:
+                    logger.debug("First token for %s after %.2fs", ctx.user, loop.time() - last_edit)
+                response += chunk.choices[0].delta.content
+                pending_tokens += 1
+
+                # edit in batches to stay within discord rate limits
+                if pending_tokens >= edit_tokens or loop.time() - last_edit >= edit_interval:
+                    edit_start = loop.time()
+                    discord_msg, msg_start = await self.helper_stream_render(ctx, response, discord_msg, msg_start)
+                    pending_tokens = 0
+                    last_edit = loop.time()
+                    deadline += last_edit - edit_start
+        except TimeoutError:
+            logger.error("TimeoutError: OpenAI API stream timed out.")
+            complete = False
+            if response.strip():
+                response += self.stream_cut_off_note
+        finally:
+            if stream is not None:
+                await stream.close()
+
+        if response.strip():
+            await self.helper_stream_render(ctx, response, discord_msg, msg_start)
+
+        return response, complete
+
+    async def helper_stream_render(
+        self,
+        ctx: discord.Interaction,
+        response: str,
+        discord_msg: discord.WebhookMessage | None,
+        msg_start: int,
+        max_length: int = 2000,
+    ) -> tuple:
+        """render the streamed response so far into followup messages, completed messages are finalized and the
+        remaining text is sent or edited into the current message
+
+        Args:
+            ctx (discord.Interaction): interaction context
+            response (str): streamed response so far
+            discord_msg (discord.WebhookMessage, optional): followup message currently being edited
+            msg_start (int): position in response where the current followup message starts
+            max_length (int, optional): max length of a discord message. Defaults to 2000.
+
+        Returns:
+            tuple: followup message currently being edited, position in response where it starts
+        """
+        while len(response) - msg_start > max_length:
+            # split at the last line break or space that fits into the message, dropping it from the next message
+            split = response.rfind("\n", msg_start, msg_start + max_length)
+            if split <= msg_start:
+                split = response.rfind(" ", msg_start, msg_start + max_length)
+            next_start = split + 1
+            if split <= msg_start:
+                split = next_start = msg_start + max_length
+
+            await self.helper_stream_send(ctx, response[msg_start:split], discord_msg)
+            discord_msg = None
+            msg_start = next_start
+
+        content = response[msg_start:]
+        if content.strip() and (discord_msg is None or discord_msg.content != content):
+            discord_msg = await self.helper_stream_send(ctx, content, discord_msg)
+
+        return discord_msg, msg_start
+
+    async def helper_stream_send(
+        self,
+        ctx: discord.Interaction,
+        content: str,
+        discord_msg: discord.WebhookMessage | None,
+    ) -> discord.WebhookMessage:
+        """send a new followup message or edit the current one
+
+        Args:
+            ctx (discord.Interaction): interaction context
+            content (str): message content
+            discord_msg (discord.WebhookMessage, optional): followup message to edit, None to send a new one
+
+        Returns:
+            discord.WebhookMessage: sent or edited followup message
+        """
+        if discord_msg is None:
+            return await ctx.followup.send(content, wait=True)
+        return await discord_msg.edit(content=content)
 
-    def helper_oai_chat_call(
+    async def helper_oai_chat_call(
         self,
         message_context: list,
         model: str = "gpt-4",
@@ -128,7 +585,8 @@ class GenAICommands(commands.Cog):
         frequency_penalty: float = 0,
         timeout: int = 60,
     ):
-        """helper function to call openai api chat completion endpoint with client-side timeout
+        """helper function to call openai api chat completion endpoint with client-side timeout, the request is
+        cancelled once the timeout is reached
 
         Args:
             message_context (list): list of dicts with message context
@@ -142,26 +600,30 @@ class GenAICommands(commands.Cog):
         Returns:
             None if timeout, else openai response
         """
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(
-                self.oai_client.chat.completions.create,
-                messages=message_context,
-                model=model,
-                max_tokens=max_tokens,
-                n=n,
-                temperature=temperature,
-                frequency_penalty=frequency_penalty,
-            )
-
-            try:
-                return future.result(timeout=timeout)
-            except TimeoutError:
-                logger.error("TimeoutError: OpenAI API call timed out.")
-                return None
+        try:
+            oai_client = await self.helper_get_oai_client()
+            await self.rate_limiter.acquire_upstream("openai")
+            with self.metrics.timer("upstream", "openai_chat"):
+                return await asyncio.wait_for(
+                    oai_client.chat.completions.create(
+                        messages=message_context,
+                        model=model,
+                        max_tokens=max_tokens,
+                        n=n,
+                        temperature=temperature,
+                        frequency_penalty=frequency_penalty,
+                    ),
+                    timeout=timeout,
+                )
+        except TimeoutError:
+            logger.error("TimeoutError: OpenAI API call timed out.")
+            return None
 
     # >>> image generation <<< #
     @app_commands.command(name="img", description="Generate an image based on a text description.")
     @app_commands.describe(description="Your description of the image, e.g. 'A cat sitting on a table'.")
+    # checks run bottom-up, so the cooldown rejects a call before it takes a request of the user's rate limit
+    @rate_limit()
     @app_commands.checks.cooldown(1, 60)
     async def img(self, ctx: discord.Interaction, description: str) -> None:
         """Generate an image based on a text description.
@@ -175,62 +637,175 @@ class GenAICommands(commands.Cog):
         await ctx.response.defer(thinking=True)
 
         try:
-            response = self.helper_get_img_response(
+            response = await self.helper_get_img_response(
                 ctx=ctx,
                 description=description,
             )
         except Exception as e:
-            logger.error(f"Error with OpenAI API: {e}")
+            logger.error("Error with OpenAI API: %s", e)
             await ctx.followup.send(self.error_msg_tired_robot)
             return
 
+        if response is None:
+            logger.info("Image job of %s expired, interaction token is no longer valid.", ctx.user)
+            return
+
+        if isinstance(response, str):
+            await ctx.followup.send(response)
+            return
+
         logger.info("Sending GPT image response.")
-        await ctx.followup.send(response)
+        await ctx.followup.send(file=discord.File(io.BytesIO(response), filename="image.png"))
 
-    def helper_get_img_response(
+    async def helper_get_img_response(
         self,
         ctx: discord.Interaction,
         description: str,
-    ) -> str:
-        """query openai api for image generation
+    ) -> bytes | str | None:
+        """get a cached image or queue an image generation job and wait for it, showing its queue position in the
+        original response
 
         Args:
             ctx (discord.Interaction): interaction context
             description (str): description to send to openai
 
         Returns:
-            str: image url
+            bytes | str: image or error message, None if the job expired with the interaction token
         """
-        # use Open AI api to generate image, wrapped in a timeout
-        response_oai = self.helper_oai_img_call(description=description)
+        cache_key = ImageCache.key(
+            prompt=description,
+            model=self.config_params["oai_img_model"],
+            size=self.config_params["oai_img_size"],
+        )
+        image = await asyncio.to_thread(self.img_cache.get, cache_key)
+        if image is not None:
+            logger.info("Image for %s served from image cache.", ctx.user)
+            return image
+
+        # followups can no longer be sent once the interaction token expires, keep a few seconds to send the image
+        token_timeout = (ctx.expires_at - discord.utils.utcnow()).total_seconds() - 5
+
+        job = self.img_queue.submit(
+            owner=ctx.user.id,
+            func=lambda: self.helper_generate_img(description=description, cache_key=cache_key),
+            timeout=token_timeout,
+        )
+        if job is None:
+            return "You already have images in the queue. Please wait for them to finish. :hourglass:"
 
+        try:
+            position = None
+            while not job.future.done():
+                new_position = self.img_queue.position(job)
+                if new_position != position:
+                    position = new_position
+                    await self.helper_img_status(ctx=ctx, position=position)
+                await asyncio.wait([job.future], timeout=self.config_params["img_queue_status_interval"])
+        finally:
+            # e.g. the command is cancelled while waiting
+            if not job.future.done():
+                self.img_queue.cancel(job)
+
+        if job.future.cancelled():
+            return None
+
+        image = job.future.result()
         # check if timeout
-        if response_oai is None:
+        if image is None:
             return self.error_msg_tired_robot
         else:
-            # extract response content
-            return response_oai
+            return image
+
+    async def helper_generate_img(self, description: str, cache_key: str) -> bytes | None:
+        """generate an image, download it into memory and add it to the image cache
+
+        Args:
+            description (str): description to send to openai
+            cache_key (str): image cache key of description, model and size
+
+        Returns:
+            bytes: image, None if generation or download failed
+        """
+        # use Open AI api to generate image, wrapped in a timeout
+        url = await self.helper_oai_img_call(
+            description=description,
+            model=self.config_params["oai_img_model"],
+            size=self.config_params["oai_img_size"],
+            timeout=self.config_params["oai_img_timeout"],
+        )
+        if url is None:
+            return None
+
+        # image urls expire, so the image is attached instead of linked
+        try:
+            status, image = await self.api_client.get_bytes(
+                url, max_size=self.config_params["img_download_max_mb"] * 1024 * 1024
+            )
+        except (aiohttp.ClientError, TimeoutError) as e:
+            logger.error("Error in image download: %r", e)
+            return None
+        if status != 200 or not image:
+            logger.error("Error in image download: status %s", status)
+            return None
+
+        await asyncio.to_thread(self.img_cache.set, cache_key, image)
+        stats = self.img_cache.stats()
+        logger.debug(
+            "Image cache: %s images, %.1f MB, %.0f%% hit ratio",
+            stats["size"], stats["bytes"] / 1024 / 1024, stats["hit_ratio"] * 100,
+        )
+        return image
+
+    async def helper_img_status(self, ctx: discord.Interaction, position: int) -> None:
+        """show the queue position of an image job in the original response
+
+        Args:
+            ctx (discord.Interaction): interaction context
+            position (int): queue position of the job, 0 if it is running
+        """
+        if position:
+            content = f"Your image is queued at position {position}. :hourglass:"
+        else:
+            content = "Your image is being generated. :art:"
 
-    def helper_oai_img_call(self, description: str, timeout: int = 180):
-        """helper function to call openai api image gen endpoint with client-side timeout
+        try:
+            await ctx.edit_original_response(content=content)
+        except discord.HTTPException as e:
+            # status updates are optional, the image is still sent once done
+            logger.warning("Image queue status for %s not updated: %s", ctx.user, e)
+
+    async def helper_oai_img_call(
+        self,
+        description: str,
+        model: str = "dall-e-3",
+        size: str = "1024x1024",
+        timeout: int = 180,
+    ):
+        """helper function to call openai api image gen endpoint with client-side timeout, the request is
+        cancelled once the timeout is reached
 
         Args:
             description (str): description of the image to send to openai
+            model (str, optional): openai image model to use. Defaults to "dall-e-3".
+            size (str, optional): image size. Defaults to "1024x1024".
             timeout (int, optional): timeout in seconds. Defaults to 180.
 
         Returns:
             None if timeout, else url to image
         """
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(self.oai_client.images.generate, model="dall-e-3", n=1, size="1024x1024", prompt=description)
+        try:
+            oai_client = await self.helper_get_oai_client()
+            await self.rate_limiter.acquire_upstream("openai")
             # TODO: move size to user input
-
-            try:
-                response_oai = future.result(timeout=timeout)
-                return response_oai.data[0].url  # type: ignore
-            except TimeoutError:
-                logger.error("TimeoutError: OpenAI API call timed out.")
-                return None
+            with self.metrics.timer("upstream", "openai_images"):
+                response_oai = await asyncio.wait_for(
+                    oai_client.images.generate(model=model, n=1, size=size, prompt=description),  # type: ignore
+                    timeout=timeout,
+                )
+            return response_oai.data[0].url  # type: ignore
+        except TimeoutError:
+            logger.error("TimeoutError: OpenAI API call timed out.")
+            return None
 
     @img.error  # type: ignore
     async def img_error(self, ctx: discord.Interaction, error: app_commands.AppCommandError) -> None:
@@ -242,12 +817,12 @@ class GenAICommands(commands.Cog):
         """
         _ = extract_command_name(ctx, logger)
 
-        if isinstance(error, app_commands.CommandOnCooldown):
-            logger.info(f"User {ctx.user} is on cooldown for img command.")
+        if isinstance(error, (app_commands.CommandOnCooldown, RateLimited)):
+            logger.info("User %s is on cooldown for img command.", ctx.user)
             await ctx.response.send_message(
                 f"Sorry, you are on cooldown for this command. Try again in {error.retry_after:.2f} seconds.",
                 ephemeral=True,
             )
         else:
-            logger.error(f"Error with img command: {error}")
+            logger.error("Error with img command: %s", error)
             await ctx.response.send_message("Sorry, something went wrong. Please try again later.", ephemeral=True)
@@ -4,7 +4,7 @@ import logging
 import discord
 from discord import app_commands
 from discord.ext import commands
-from utils.helpers import extract_command_name
+from utils.helpers import extract_command_name, is_bot_owner
 
 logger = logging.getLogger(__name__)
 
@@ -96,6 +96,106 @@ class GeneralCommands(commands.Cog):
 
         return message
 
+    def helper_get_cache_stats(self) -> list:
+        """creates message rows with cache statistics
+
+        Returns:
+            list: rows with hit and miss counters per in-process cache
+        """
+        caches = self.bot.caches  # type: ignore
+        if not caches:
+            return ["No caches registered."]
+
+        rows = [":card_box: **Cache stats**"]
+        for name, cache in caches.items():
+            stats = cache.stats()
+            rows.append(
+                f"**{name}:** {stats['size']}/{stats['max_size']} entries - "
+                f"{stats['hits']} hits, {stats['stale_hits']} stale hits, {stats['misses']} misses "
+                f"({stats['coalesced']} coalesced), {stats['hit_ratio']:.0%} hit ratio, "
+                f"{stats['evictions']} evictions"
+            )
+
+        return rows
+
+    @app_commands.command(name="stats", description="Show latency, error and cache statistics (bot owner only).")
+    @is_bot_owner()
+    async def stats(self, ctx: discord.Interaction) -> None:
+        """Show latency percentiles and errors per command and upstream API and cache statistics.
+
+        Args:
+            ctx (discord.Interaction): discord context
+        """
+        _ = extract_command_name(ctx, logger)
+
+        response = self.helper_get_stats()
+        logger.info("Sending stats")
+
+        await ctx.response.send_message(response, ephemeral=True)
+
+    def helper_get_stats(self) -> str:
+        """creates a message with latency, error and cache statistics
+
+        Returns:
+            str: message displayed to bot owner with statistics
+        """
+        metrics = self.bot.metrics  # type: ignore
+        rows = [":bar_chart: **Stats**"]
+        for kind, title in (("command", "Commands"), ("upstream", "Upstream APIs")):
+            summary = metrics.summary(kind)
+            if not summary:
+                rows.append(f"**{title}:** no calls yet")
+                continue
+            table = [f"{'name':<24} {'calls':>6} {'errors':>6} {'p50':>7} {'p95':>7} {'p99':>7}"]
+            for name, count, errors, p50, p95, p99 in summary:
+                table.append(f"{name[:24]:<24} {count:>6} {errors:>6} {p50:>6.2f}s {p95:>6.2f}s {p99:>6.2f}s")
+            rows.append(f"**{title}:**\n```\n" + "\n".join(table) + "\n```")
+
+        loop_monitor = self.bot.loop_monitor  # type: ignore
+        if loop_monitor is not None:
+            loop_stats = loop_monitor.stats()
+            rows.append(
+                f"**Event loop:** lag {loop_stats['last_lag'] * 1000:.0f} ms "
+                f"(max {loop_stats['max_lag'] * 1000:.0f} ms), {loop_stats['slow']} slow ticks, "
+                f"{loop_stats['stalls']} stalls captured"
+            )
+
+        rows.extend(self.helper_get_cache_stats())
+        return self.helper_fit_rows(rows)
+
+    def helper_fit_rows(self, rows: list, max_length: int = 2000) -> str:
+        """joins message rows, dropping whole rows from the end to stay within the discord message length limit, so
+        code blocks are never cut
+
+        Args:
+            rows (list): message rows
+            max_length (int, optional): max length of a discord message. Defaults to 2000.
+
+        Returns:
+            str: message with as many rows as fit
+        """
+        note = "*(truncated)*"
+        message = "\n".join(rows)
+        while len(message) > max_length and rows:
+            rows = rows[:-1]
+            message = "\n".join(rows + [note])
+        return message
+
+    @stats.error  # type: ignore
+    async def stats_error(self, ctx: discord.Interaction, error: app_commands.AppCommandError) -> None:
+        """Error handler for stats command
+
+        Args:
+            ctx (discord.Interaction): discord context
+            error (app_commands.AppCommandError): error
+        """
+        if isinstance(error, app_commands.CheckFailure):
+            logger.info("User %s is not allowed to use stats command.", ctx.user)
+            await ctx.response.send_message("This command is reserved for the bot owner.", ephemeral=True)
+        else:
+            logger.error("Error with stats command: %s", error)
+            await ctx.response.send_message("Sorry, something went wrong. Please try again later.", ephemeral=True)
+
 
     # >>> GENERAL CONTEXT MENUS <<< #
     async def show_join_date(self, ctx: discord.Interaction, member: discord.Member) -> None:
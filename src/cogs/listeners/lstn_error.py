@@ -1,6 +1,10 @@
 import logging
 
+import discord
+from discord import app_commands
 from discord.ext import commands
+from utils.helpers import record_command_latency
+from utils.rate_limit import RateLimited
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +21,39 @@ class ErrorListeners(commands.Cog):
         """Listener for errors
         """
         self.bot = bot
-        logger.debug(f"Listeners: {self.get_listeners()}")
+        self.default_app_command_error = bot.tree.on_error
+        logger.debug("Listeners: %s", self.get_listeners())
+
+    async def cog_load(self) -> None:
+        """Register the app command error handler when the cog is loaded
+        """
+        self.bot.tree.on_error = self.on_app_command_error
+
+    async def cog_unload(self) -> None:
+        """Restore the default app command error handler when the cog is unloaded
+        """
+        self.bot.tree.on_error = self.default_app_command_error
+
+    async def on_app_command_error(self, ctx: discord.Interaction, error: app_commands.AppCommandError):
+        """Handler for app command errors, called after the error handlers of the command
+
+        Args:
+            ctx (discord.Interaction): discord context
+            error (app_commands.AppCommandError): app command error to handle
+        """
+        cmd_name = ctx.command.name if ctx.command else "unknown"
+        record_command_latency(ctx, error=True)
+
+        # tell the user when to try again if they exceed their rate limit
+        if isinstance(error, RateLimited):
+            logger.info("User %s is rate limited for %s.", ctx.user, cmd_name)
+            if not ctx.response.is_done():
+                await ctx.response.send_message(
+                    f"Slow down! :snail: Try again in {error.retry_after:.1f} seconds.", ephemeral=True
+                )
+            return
+
+        await self.default_app_command_error(ctx, error)
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx: commands.Context, error: commands.errors.CommandError):
@@ -28,14 +64,14 @@ class ErrorListeners(commands.Cog):
             error (commands.errors.CommandError): command error to handle
         """
         cmd_name = ctx.command.name if ctx.command else "unknwon"
-        logger.error(f"Error in command {cmd_name}: {error}")
+        logger.error("Error in command %s: %s", cmd_name, error)
 
         # warn the user if they do not have the correct role
         if isinstance(error, commands.errors.CheckFailure):
-            logger.error(f"User {ctx.author} does not have the correct role to execute {cmd_name}.")
+            logger.error("User %s does not have the correct role to execute %s.", ctx.author, cmd_name)
             await ctx.reply("You do not have the correct role for this command.")
 
         # warn the user if they enter an invalid command
         if isinstance(error, commands.errors.CommandNotFound):
-            logger.error(f"User {ctx.author} entered an invalid command.")
+            logger.error("User %s entered an invalid command.", ctx.author)
             await ctx.reply("Not a viable comment. Type '/' to see a list of commands.")
\ No newline at end of file
@@ -19,8 +19,8 @@ class MsgListeners(commands.Cog):
         """Listener for errors
         """
         self.bot = bot
-        logger.debug(f"Listeners: {self.get_listeners()}")
+        logger.debug("Listeners: %s", self.get_listeners())
 
     @commands.Cog.listener()
     async def on_message(self, msg: discord.Message):
-        logger.debug(f"Message: {msg}")
\ No newline at end of file
+        logger.debug("Message: %s", msg)
\ No newline at end of file
@@ -1,23 +1,60 @@
+import asyncio
+import contextvars
+import functools
+import gzip
+import json
 import logging
+import os
 import sqlite3
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from sqlite3 import Error
+from typing import Any, Callable, TextIO
 
 from database.helper_db import open_connection
+from utils.helpers import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# pragmas for the long-lived chat db connection: write-ahead log allows reads during writes, NORMAL sync is safe
+# in WAL mode and avoids an fsync per commit, page cache of ~8 MB and memory mapped reads of up to 64 MB
+CHAT_DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -8000,
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
 
-def create_chat_db(
-    db_file_path: str,
-):
-    """create a SQLite database and relevant tables for storing chat data
+# max seconds between retries of a failed batch write
+WRITE_RETRY_BACKOFF_MAX = 30
 
-    Args:
-        db_file_path (str): path to the database file
-    """
-    conn = open_connection(db_file_path=db_file_path)
-    create_chat_table(connection=conn)
-    conn.close()
+# schema migrations of the chat db, applied in order on start up and tracked in PRAGMA user_version
+CHAT_DB_MIGRATIONS = [
+    # 1: composite index for per-user history lookups within a timeframe
+    ["CREATE INDEX IF NOT EXISTS idx_chat_author_timestamp ON chat (author, timestamp)"],
+    # 2: token count per message, computed once at insert, backfilled with the same estimate as estimate_tokens
+    [
+        "ALTER TABLE chat ADD COLUMN tokens integer NOT NULL DEFAULT 0",
+        "UPDATE chat SET tokens = (length(message) + 3) / 4",
+    ],
+    # 3: rolling summary per user of messages older than the recent context window
+    [
+        """CREATE TABLE IF NOT EXISTS chat_summary (
+            author text PRIMARY KEY,
+            summary text NOT NULL,
+            tokens integer NOT NULL,
+            source_tokens integer NOT NULL,
+            last_message_id integer NOT NULL,
+            timestamp datetime NOT NULL
+        )""",
+    ],
+    # 4: incremental auto vacuum, so pages freed by the retention job can be returned to the file system.
+    # Only takes effect on an existing db once it is vacuumed, which must run outside a transaction.
+    ["PRAGMA auto_vacuum = INCREMENTAL", "VACUUM"],
+]
 
 
 def create_chat_table(
@@ -41,59 +78,470 @@ def create_chat_table(
         c.execute(sql_create_chat_table)
         logger.info("Chat table created successfully (if not already existing)")
     except Error as e:
-        logger.error(f"Chat table not created successfully: {e}")
+        logger.error("Chat table not created successfully: %s", e)
 
 
-def add_message_to_chat_db(
-    username: str,
-    message: str,
-    role: str,
+def migrate_chat_db(
     connection: sqlite3.Connection,
 ):
-    """add a user message to the chat database
+    """apply pending schema migrations to the chat database
 
     Args:
-        message (str): user message
-        username (str): username of the user this conversation is with
-        role (str): role who created the message text, either "user" or "assistant" for the model
-        connection (sqlite3.Connection): connection to the chat database
+        connection (sqlite3.Connection): connection to the database
     """
-    sql_query = "INSERT INTO chat(author,message,role,timestamp) VALUES(?,?,?,datetime('now'))"
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
 
-    try:
-        cur = connection.cursor()
-        cur.execute(sql_query, (username, message, role))
-        connection.commit()
-        logger.info(f"Message for {username}:{role} added to chat db.")
-    except Error as e:
-        logger.error(f"Message for {username}:{role} not added to chat db: {e}.")
+    for new_version, statements in enumerate(CHAT_DB_MIGRATIONS[version:], start=version + 1):
+        try:
+            with connection:
+                for statement in statements:
+                    connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {new_version}")
+            logger.info("Chat db migrated to schema version %s", new_version)
+        except Error as e:
+            logger.error("Chat db not migrated to schema version %s: %s", new_version, e)
+            raise e
 
 
-def get_chat_history(username: str, connection: sqlite3.Connection, timeframe: float = 2) -> list:
-    """get the chat history of a user
+class ChatStore:
+    def __init__(
+        self,
+        db_file_path: str,
+        write_batch_size: int = 50,
+        write_interval: float = 0.2,
+        write_queue_size: int = 1000,
+        history_size: int = 5,
+        history_cache_users: int = 1000,
+        close_timeout: float = 10,
+    ) -> None:
+        """Chat history store owning a long-lived connection to the chat database. All database I/O runs on a
+        dedicated thread, so it never blocks the event loop. New messages are queued and written behind in batches,
+        while reads still see messages that are not yet written. The latest messages of active users are kept in
+        memory, so their history is read without any disk I/O.
 
-    Args:
-        username (str): username of the user this conversation is with
-        connection (sqlite3.Connection): connection to the chat database
-        timeframe (str): timeframe to get the chat history for in hours. Defaults to 2 hours.
+        Args:
+            db_file_path (str): path to the database file
+            write_batch_size (int, optional): max nr of messages written in one transaction. Defaults to 50.
+            write_interval (float, optional): max seconds a queued message waits for its batch. Defaults to 0.2.
+            write_queue_size (int, optional): max nr of queued messages before adding messages waits.
+                Defaults to 1000.
+            history_size (int, optional): nr of latest messages kept in memory per user. Defaults to 5.
+            history_cache_users (int, optional): max nr of users with messages kept in memory, least recently
+                active users are evicted. Defaults to 1000.
+            close_timeout (float, optional): max seconds closing waits for queued messages to be written.
+                Defaults to 10.
+        """
+        self.db_file_path = db_file_path
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self.close_timeout = close_timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-db")
+        self._conn: sqlite3.Connection | None = None
 
-    Returns:
-        list: list of tuples containing the chat history
-    """
-    logger.info(f"Retrieving message hist for {username} from chat db.")
-    sql_query = f"""SELECT role, message
-            FROM chat
-            WHERE author = '{username}' AND timestamp > datetime('now', '-{timeframe} hours')
-            ORDER BY timestamp ASC;
+        # write-behind queue and overlay of queued messages per author, only changed on the event loop. Messages are
+        # numbered in order, the chat db thread tracks the last written one, so reads merge exactly the messages
+        # they did not read from the chat db.
+        self._write_queue: asyncio.Queue = asyncio.Queue(maxsize=write_queue_size)
+        self._pending: dict[str, list[tuple]] = {}
+        self._writer_task: asyncio.Task | None = None
+        self._queued_seq = 0
+        # only used on the chat db thread
+        self._written_seq = 0
+
+        # ring buffer of latest messages per user, a user is only cached once the history is read from the chat db
+        self.history_size = history_size
+        self.history_cache_users = history_cache_users
+        self._recent: OrderedDict[str, deque] = OrderedDict()
+        # users with a history read in flight, flagged if a message is added before the read completes
+        self._reading: dict[str, bool] = {}
+        self.history_hits = 0
+        self.history_misses = 0
+        self.history_evictions = 0
+        # rolling conversation summaries of cached users, None if a user has no summary
+        self._summaries: dict[str, tuple | None] = {}
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a function on the chat db thread in a copy of the current context, so its logs keep the correlation id
+
+        Args:
+            func (Callable): function to run
+
+        Returns:
+            return value of the function
         """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, func, *args, **kwargs))
 
-    try:
-        c = connection.cursor()
-        c.execute(sql_query)
-        chat_history = [row for row in c]
-        logger.info(f"Chat history for {username} retrieved: {len(chat_history)} relevant messages found.")
-    except (Error, Exception) as e:
-        logger.error(f"Chat history for {username} not retrieved: {e}")
-        chat_history = []
-
-    return chat_history
+    async def open(self) -> None:
+        """Open the connection to the chat database, create relevant tables if not existing and migrate them"""
+        self._conn = await self._run(self._open)
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def _open(self) -> sqlite3.Connection:
+        conn = open_connection(db_file_path=self.db_file_path, pragmas=CHAT_DB_PRAGMAS)
+        create_chat_table(connection=conn)
+        migrate_chat_db(connection=conn)
+        return conn
+
+    async def flush(self) -> None:
+        """Wait until all queued messages are written to the chat database"""
+        await self._write_queue.join()
+
+    async def close(self) -> None:
+        """Write queued messages, close the connection to the chat database and stop the chat db thread"""
+        if self._writer_task is not None:
+            try:
+                await asyncio.wait_for(self.flush(), timeout=self.close_timeout)
+            except TimeoutError:
+                unwritten = sum(len(pending) for pending in self._pending.values())
+                logger.error("%s queued messages not written to chat db before close.", unwritten)
+            self._writer_task.cancel()
+            self._writer_task = None
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+            logger.debug("Connection to chat db closed: %s", self.db_file_path)
+        self._executor.shutdown(wait=True)
+
+    async def add_message(self, username: str, message: str, role: str) -> None:
+        """add a user message to the chat database, the message is queued and written in the next batch. Waits if
+        the write queue is full.
+
+        Args:
+            username (str): username of the user this conversation is with
+            message (str): user message
+            role (str): role who created the message text, either "user" or "assistant" for the model
+        """
+        # same format as datetime('now') in SQLite, so queued and written messages compare alike
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        tokens = estimate_tokens(message)
+        self._queued_seq += 1
+        item = (self._queued_seq, (username, message, role, timestamp, tokens))
+
+        self._pending.setdefault(username, []).append(item)
+        if username in self._reading:
+            self._reading[username] = True
+        if username in self._recent:
+            self._recent[username].append((role, message, timestamp, tokens))
+        await self._write_queue.put(item)
+        logger.debug("Message for %s:%s queued for chat db.", username, role)
+
+    async def _writer(self) -> None:
+        """Write queued messages in batches of up to write_batch_size messages or every write_interval seconds. A
+        failed batch is retried with backoff, so messages are written in order and none are dropped."""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._write_queue.get()]
+            deadline = loop.time() + self.write_interval
+            while len(batch) < self.write_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._write_queue.get(), timeout=remaining))
+                except TimeoutError:
+                    break
+
+            delay = self.write_interval
+            while True:
+                try:
+                    await self._run(self._write_batch, [entry for _, entry in batch], batch[-1][0])
+                    break
+                except Error as e:
+                    logger.error(
+                        "Batch of %s messages not written to chat db, retry in %.1fs: %s", len(batch), delay, e
+                    )
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, WRITE_RETRY_BACKOFF_MAX)
+
+            # written messages are no longer pending
+            for item in batch:
+                author = item[1][0]
+                pending = self._pending.get(author)
+                if pending and item in pending:
+                    pending.remove(item)
+                if not pending:
+                    self._pending.pop(author, None)
+                self._write_queue.task_done()
+
+    def _write_batch(self, batch: list, last_seq: int) -> None:
+        sql_query = "INSERT INTO chat(author,message,role,timestamp,tokens) VALUES(?,?,?,?,?)"
+
+        with self._conn:  # type: ignore
+            self._conn.executemany(sql_query, batch)  # type: ignore
+        # reads run on this thread too, so they see the written messages and this number at once
+        self._written_seq = last_seq
+        logger.info("Batch of %s messages added to chat db.", len(batch))
+
+    async def get_history(self, username: str, timeframe: float = 2, limit: int = 5) -> list:
+        """get the latest messages of the chat history of a user, including queued messages. Served from memory
+        for active users, read from the chat db otherwise.
+
+        Args:
+            username (str): username of the user this conversation is with
+            timeframe (str): timeframe to get the chat history for in hours. Defaults to 2 hours.
+            limit (int, optional): max nr of latest messages to get. Defaults to 5.
+
+        Returns:
+            list: list of tuples of role, message and token count, oldest message first
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=timeframe)).strftime("%Y-%m-%d %H:%M:%S")
+
+        recent = self._recent.get(username)
+        if recent is not None and limit <= self.history_size:
+            self.history_hits += 1
+            self._recent.move_to_end(username)
+            # drop messages which left the timeframe
+            while recent and recent[0][2] <= cutoff:
+                recent.popleft()
+            chat_history = [(role, message, tokens) for role, message, _, tokens in recent]
+            chat_history = chat_history[-limit:] if limit > 0 else []
+            logger.debug("Chat history for %s served from memory: %d messages.", username, len(chat_history))
+            return chat_history
+
+        # read from chat db and keep the latest messages in memory, unless a message was added meanwhile
+        self.history_misses += 1
+        self._reading[username] = False
+        read_limit = max(limit, self.history_size)
+        try:
+            rows, written_seq = await self._run(self._get_history, username, timeframe, read_limit)
+        finally:
+            added_meanwhile = self._reading.pop(username, True)
+
+        # add queued messages which were not yet written at the time of the read, newer than all written ones
+        pending = [
+            (role, message, timestamp, tokens)
+            for seq, (_, message, role, timestamp, tokens) in self._pending.get(username, ())
+            if seq > written_seq and timestamp > cutoff
+        ]
+        rows = (rows + pending)[-read_limit:]
+        if not added_meanwhile:
+            self._recent[username] = deque(rows, maxlen=self.history_size)
+            self._recent.move_to_end(username)
+            while len(self._recent) > self.history_cache_users:
+                evicted, _ = self._recent.popitem(last=False)
+                self._summaries.pop(evicted, None)
+                self.history_evictions += 1
+
+        return [(role, message, tokens) for role, message, _, tokens in rows][-limit:] if limit > 0 else []
+
+    def _get_history(self, username: str, timeframe: float, limit: int) -> tuple:
+        logger.info("Retrieving message hist for %s from chat db.", username)
+        # latest messages first to let the (author, timestamp) index serve the limit, reversed below
+        sql_query = """SELECT role, message, timestamp, tokens
+                FROM chat
+                WHERE author = ? AND timestamp > datetime('now', ?)
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?;
+            """
+
+        try:
+            c = self._conn.cursor()  # type: ignore
+            c.execute(sql_query, (username, f"-{timeframe} hours", limit))
+            chat_history = c.fetchall()[::-1]
+        except (Error, Exception) as e:
+            logger.error("Chat history for %s not retrieved: %s", username, e)
+            chat_history = []
+        logger.info("Chat history for %s retrieved: %s relevant messages found.", username, len(chat_history))
+
+        return chat_history, self._written_seq
+
+    async def get_summary(self, username: str, timeframe: float = 2) -> tuple | None:
+        """get the rolling summary of a user's earlier conversation
+
+        Args:
+            username (str): username of the user this conversation is with
+            timeframe (str): timeframe of the chat history in hours, older summaries are ignored. Defaults to 2 hours.
+
+        Returns:
+            tuple: summary, its token count and token count of the summarized messages, None if there is no summary
+        """
+        if username not in self._summaries:
+            self._summaries[username] = await self._run(self._get_summary, username)
+
+        summary = self._summaries[username]
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=timeframe)).strftime("%Y-%m-%d %H:%M:%S")
+        if summary is None or summary[4] <= cutoff:
+            return None
+        return summary[:3]
+
+    def _get_summary(self, username: str) -> tuple | None:
+        sql_query = """SELECT summary, tokens, source_tokens, last_message_id, timestamp
+                FROM chat_summary
+                WHERE author = ?;
+            """
+
+        try:
+            return self._conn.execute(sql_query, (username,)).fetchone()  # type: ignore
+        except Error as e:
+            logger.error("Chat summary for %s not retrieved: %s", username, e)
+            return None
+
+    async def get_unsummarized(self, username: str, timeframe: float = 2, keep_recent: int = 5) -> list:
+        """get messages of a user's chat history which are not yet summarized, excluding the latest messages
+
+        Args:
+            username (str): username of the user this conversation is with
+            timeframe (str): timeframe to get the chat history for in hours. Defaults to 2 hours.
+            keep_recent (int, optional): nr of latest messages to exclude, as they are sent as is. Defaults to 5.
+
+        Returns:
+            list: list of tuples of id, role, message, token count and timestamp, oldest message first
+        """
+        # summarized messages are referenced by id, so queued messages are written first
+        await self.flush()
+        return await self._run(self._get_unsummarized, username, timeframe, keep_recent)
+
+    def _get_unsummarized(self, username: str, timeframe: float, keep_recent: int) -> list:
+        summary = self._get_summary(username)
+        last_message_id = summary[3] if summary else 0
+        sql_query = """SELECT id, role, message, tokens, timestamp
+                FROM chat
+                WHERE author = ? AND timestamp > datetime('now', ?) AND id > ?
+                ORDER BY timestamp ASC, id ASC;
+            """
+
+        try:
+            c = self._conn.cursor()  # type: ignore
+            rows = c.execute(sql_query, (username, f"-{timeframe} hours", last_message_id)).fetchall()
+        except Error as e:
+            logger.error("Unsummarized chat history for %s not retrieved: %s", username, e)
+            return []
+
+        return rows[:-keep_recent] if keep_recent > 0 else rows
+
+    async def set_summary(
+        self, username: str, summary: str, source_tokens: int, last_message_id: int, timestamp: str
+    ) -> None:
+        """add or replace the rolling summary of a user's earlier conversation
+
+        Args:
+            username (str): username of the user this conversation is with
+            summary (str): summary of the conversation up to the last summarized message
+            source_tokens (int): token count of all summarized messages
+            last_message_id (int): id of the last summarized message
+            timestamp (str): timestamp of the last summarized message
+        """
+        row = (summary, estimate_tokens(summary), source_tokens, last_message_id, timestamp)
+        await self._run(self._set_summary, username, row)
+        self._summaries[username] = row
+
+    def _set_summary(self, username: str, row: tuple) -> None:
+        sql_query = """INSERT OR REPLACE INTO chat_summary
+                (author,summary,tokens,source_tokens,last_message_id,timestamp)
+                VALUES(?,?,?,?,?,?)"""
+
+        try:
+            with self._conn:  # type: ignore
+                self._conn.execute(sql_query, (username, *row))  # type: ignore
+            logger.info("Chat summary for %s added to chat db.", username)
+        except Error as e:
+            logger.error("Chat summary for %s not added to chat db: %s.", username, e)
+
+    async def maintain(self, retention_days: float, archive_dir: str = "") -> dict:
+        """delete messages and summaries older than the retention from the chat database and return freed pages
+        to the file system. Deleted messages are appended to gzipped monthly archives of JSON lines first.
+
+        Args:
+            retention_days (float): days messages are kept in the chat database
+            archive_dir (str, optional): directory for monthly archives, messages are deleted without archiving
+                if empty. Defaults to "".
+
+        Returns:
+            dict: nr of archived and deleted messages, reclaimed bytes and duration in seconds
+        """
+        # pending messages are never older than the retention, but writes should not interleave with a long job
+        await self.flush()
+        result = await self._run(self._maintain, retention_days, archive_dir)
+        # summaries may have been deleted, they are read again on next use
+        self._summaries.clear()
+        return result
+
+    def _maintain(self, retention_days: float, archive_dir: str) -> dict:
+        start = time.perf_counter()
+        # cutoff is computed once, so archived and deleted messages are the same
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        archived = 0
+
+        try:
+            if archive_dir:
+                archived = self._archive(cutoff, archive_dir)
+            with self._conn:  # type: ignore
+                deleted = self._conn.execute("DELETE FROM chat WHERE timestamp < ?", (cutoff,)).rowcount  # type: ignore
+                self._conn.execute("DELETE FROM chat_summary WHERE timestamp < ?", (cutoff,))  # type: ignore
+
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]  # type: ignore
+            pages_before = self._conn.execute("PRAGMA page_count").fetchone()[0]  # type: ignore
+            self._conn.execute("PRAGMA incremental_vacuum").fetchall()  # type: ignore
+            # read right after the vacuum, optimize may allocate pages for new statistics
+            pages_after = self._conn.execute("PRAGMA page_count").fetchone()[0]  # type: ignore
+            self._conn.execute("PRAGMA optimize")  # type: ignore
+            # truncate the write-ahead log, which otherwise keeps the size of the deletes
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()  # type: ignore
+        except (Error, OSError) as e:
+            logger.error("Chat db maintenance not successful: %r", e)
+            raise e
+
+        return {
+            "archived": archived,
+            "deleted": deleted,
+            "reclaimed_bytes": (pages_before - pages_after) * page_size,
+            "duration": time.perf_counter() - start,
+        }
+
+    def _archive(self, cutoff: str, archive_dir: str) -> int:
+        """append messages older than cutoff to gzipped monthly archives, e.g. chat-2024-01.jsonl.gz"""
+        os.makedirs(archive_dir, exist_ok=True)
+        sql_query = """SELECT id, author, role, message, timestamp, tokens
+                FROM chat
+                WHERE timestamp < ?
+                ORDER BY id ASC;
+            """
+
+        archives: dict[str, TextIO] = {}
+        archived = 0
+        try:
+            # rows are streamed from the cursor, so old months are never loaded into memory at once
+            c = self._conn.cursor()  # type: ignore
+            for msg_id, author, role, message, timestamp, tokens in c.execute(sql_query, (cutoff,)):
+                month = timestamp[:7]
+                if month not in archives:
+                    # appending adds a gzip member, which is read back as one stream
+                    archive_path = os.path.join(archive_dir, f"chat-{month}.jsonl.gz")
+                    archives[month] = gzip.open(archive_path, "at")
+                record = {
+                    "id": msg_id,
+                    "author": author,
+                    "role": role,
+                    "message": message,
+                    "timestamp": timestamp,
+                    "tokens": tokens,
+                }
+                archives[month].write(json.dumps(record) + "\n")
+                archived += 1
+        finally:
+            for archive in archives.values():
+                archive.close()
+
+        logger.info("%s chat messages archived to %s (%s monthly files).", archived, archive_dir, len(archives))
+        return archived
+
+    def stats(self) -> dict:
+        """Get counters of the in-memory chat history
+
+        Returns:
+            dict: nr of cached users, hits, misses, evictions and hit ratio
+        """
+        lookups = self.history_hits + self.history_misses
+        return {
+            "size": len(self._recent),
+            "max_size": self.history_cache_users,
+            "hits": self.history_hits,
+            "stale_hits": 0,
+            "misses": self.history_misses,
+            "coalesced": 0,
+            "evictions": self.history_evictions,
+            "hit_ratio": self.history_hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,97 @@
+import logging
+import sqlite3
+from sqlite3 import Error
+
+from database.helper_db import open_connection
+
+logger = logging.getLogger(__name__)
+
+
+def create_geocode_db(
+    db_file_path: str,
+):
+    """create a SQLite database and relevant tables for storing geocoding results
+
+    Args:
+        db_file_path (str): path to the database file
+    """
+    conn = open_connection(db_file_path=db_file_path)
+    create_geocode_table(connection=conn)
+    conn.close()
+
+
+def create_geocode_table(
+    connection: sqlite3.Connection,
+):
+    """create a table to store geocoding results per normalized location query
+
+    Args:
+        connection (sqlite3.Connection): connection to the database
+    """
+    sql_create_geocode_table = """ CREATE TABLE IF NOT EXISTS geocode (
+                                        query text PRIMARY KEY,
+                                        location text NOT NULL,
+                                        lat real NOT NULL,
+                                        lng real NOT NULL,
+                                        timestamp datetime NOT NULL
+                                    ); """
+
+    try:
+        c = connection.cursor()
+        c.execute(sql_create_geocode_table)
+        logger.info("Geocode table created successfully (if not already existing)")
+    except Error as e:
+        logger.error("Geocode table not created successfully: %s", e)
+
+
+def add_geocode_to_db(
+    query: str,
+    location: str,
+    lat: float,
+    lng: float,
+    connection: sqlite3.Connection,
+):
+    """add a geocoding result to the geocode database
+
+    Args:
+        query (str): normalized location query
+        location (str): formatted address of the location
+        lat (float): latitude of the location
+        lng (float): longitude of the location
+        connection (sqlite3.Connection): connection to the geocode database
+    """
+    sql_query = "INSERT OR REPLACE INTO geocode(query,location,lat,lng,timestamp) VALUES(?,?,?,?,datetime('now'))"
+
+    try:
+        cur = connection.cursor()
+        cur.execute(sql_query, (query, location, lat, lng))
+        connection.commit()
+        logger.info("Geocode for %s added to geocode db.", query)
+    except Error as e:
+        logger.error("Geocode for %s not added to geocode db: %s.", query, e)
+
+
+def get_geocode_from_db(query: str, connection: sqlite3.Connection, max_age: float = 90) -> tuple | None:
+    """get a geocoding result from the geocode database
+
+    Args:
+        query (str): normalized location query
+        connection (sqlite3.Connection): connection to the geocode database
+        max_age (float, optional): max age of the geocoding result in days. Defaults to 90 days.
+
+    Returns:
+        tuple: location name, latitude, longitude, None if not stored or expired
+    """
+    sql_query = """SELECT location, lat, lng
+            FROM geocode
+            WHERE query = ? AND timestamp > datetime('now', ?);
+        """
+
+    try:
+        c = connection.cursor()
+        row = c.execute(sql_query, (query, f"-{max_age} days")).fetchone()
+    except Error as e:
+        logger.error("Geocode for %s not retrieved: %s", query, e)
+        return None
+
+    return tuple(row) if row else None
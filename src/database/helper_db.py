@@ -7,20 +7,24 @@ logger = logging.getLogger(__name__)
 
 def open_connection(
         db_file_path: str,
+        pragmas: dict | None = None,
     ) -> sqlite3.Connection:
     """open a database connection to a SQLite database
 
     Args:
         db_file_path (str): path to the database file
+        pragmas (dict, optional): pragmas to set on the connection, e.g. {"journal_mode": "WAL"}. Defaults to None.
 
     Returns:
         sqlite3.Connection: connection to the database
     """
     try:
         conn = sqlite3.connect(db_file_path)
-        logger.debug(f"Connection to SQLite DB successful: {db_file_path}")
+        for pragma, value in (pragmas or {}).items():
+            conn.execute(f"PRAGMA {pragma}={value}")
+        logger.debug("Connection to SQLite DB successful: %s", db_file_path)
     except Error as e:
-        logger.error(f"Connection to SQLite DB not successful: {db_file_path} - {e}")
+        logger.error("Connection to SQLite DB not successful: %s - %s", db_file_path, e)
         raise e
 
     return conn
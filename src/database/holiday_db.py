@@ -0,0 +1,93 @@
+import json
+import logging
+import sqlite3
+from sqlite3 import Error
+
+from database.helper_db import open_connection
+
+logger = logging.getLogger(__name__)
+
+
+def create_holiday_db(
+    db_file_path: str,
+):
+    """create a SQLite database and relevant tables for storing holiday data
+
+    Args:
+        db_file_path (str): path to the database file
+    """
+    conn = open_connection(db_file_path=db_file_path)
+    create_holiday_table(connection=conn)
+    conn.close()
+
+
+def create_holiday_table(
+    connection: sqlite3.Connection,
+):
+    """create a table to store public holidays per country and year
+
+    Args:
+        connection (sqlite3.Connection): connection to the database
+    """
+    sql_create_holiday_table = """ CREATE TABLE IF NOT EXISTS holiday (
+                                        country text NOT NULL,
+                                        year integer NOT NULL,
+                                        holidays text NOT NULL,
+                                        timestamp datetime NOT NULL,
+                                        PRIMARY KEY (country, year)
+                                    ); """
+
+    try:
+        c = connection.cursor()
+        c.execute(sql_create_holiday_table)
+        logger.info("Holiday table created successfully (if not already existing)")
+    except Error as e:
+        logger.error("Holiday table not created successfully: %s", e)
+
+
+def add_holidays_to_db(
+    country: str,
+    year: int,
+    holidays: list,
+    connection: sqlite3.Connection,
+):
+    """add public holidays of a country and year to the holiday database
+
+    Args:
+        country (str): country code
+        year (int): year of the holidays
+        holidays (list): holidays as returned by the date.nager.at API
+        connection (sqlite3.Connection): connection to the holiday database
+    """
+    sql_query = "INSERT OR REPLACE INTO holiday(country,year,holidays,timestamp) VALUES(?,?,?,datetime('now'))"
+
+    try:
+        cur = connection.cursor()
+        cur.execute(sql_query, (country, year, json.dumps(holidays)))
+        connection.commit()
+        logger.info("Holidays for %s:%s added to holiday db.", country, year)
+    except Error as e:
+        logger.error("Holidays for %s:%s not added to holiday db: %s.", country, year, e)
+
+
+def get_holidays_from_db(country: str, year: int, connection: sqlite3.Connection) -> list | None:
+    """get public holidays of a country and year from the holiday database
+
+    Args:
+        country (str): country code
+        year (int): year of the holidays
+        connection (sqlite3.Connection): connection to the holiday database
+
+    Returns:
+        list: holidays as returned by the date.nager.at API, None if not stored
+    """
+    sql_query = "SELECT holidays FROM holiday WHERE country = ? AND year = ?"
+
+    try:
+        c = connection.cursor()
+        row = c.execute(sql_query, (country, year)).fetchone()
+    except Error as e:
+        logger.error("Holidays for %s:%s not retrieved: %s", country, year, e)
+        return None
+
+    return json.loads(row[0]) if row else None
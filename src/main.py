@@ -4,7 +4,8 @@ import itertools
 import discord
 import yaml
 from bot import MyBot
-from database.chat_db import create_chat_db
+from database.geocode_db import create_geocode_db
+from database.holiday_db import create_holiday_db
 from utils.setup import keys_setup, log_setup
 
 
@@ -15,9 +16,12 @@ def main():
     logger = log_setup(config_params=config_params)
     # load environment variables depending on local dev or prod env
     KEYS, is_docker = keys_setup()
-    # setup database to store chat history for GPT
-    create_chat_db(
-        db_file_path=config_params["chat_db_path"],
+    # setup database to cache API data, such as public holidays and geocoding results
+    create_holiday_db(
+        db_file_path=config_params["cache_db_path"],
+    )
+    create_geocode_db(
+        db_file_path=config_params["cache_db_path"],
     )
 
     # initiate bot
@@ -45,7 +49,8 @@ def main():
 
     # run bot
     logger.info("Starting bot...")
-    bot.run(KEYS["DISCORD_TOKEN"])
+    # logging is set up in log_setup already
+    bot.run(KEYS["DISCORD_TOKEN"], log_handler=None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+import asyncio
+import io
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable
+from urllib.parse import urlsplit
+
+import aiohttp
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.metrics import Metrics
+from utils.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# status codes of responses which are retried, as the upstream is overloaded or temporarily unavailable
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ApiClient:
+    def __init__(
+        self,
+        timeout: float = 10,
+        pool_size: int = 100,
+        pool_size_per_host: int = 10,
+        keepalive_timeout: float = 30,
+        rate_limiter: RateLimiter | None = None,
+        retries: int = 2,
+        retry_backoff: float = 0.5,
+        retry_backoff_max: float = 4,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        metrics: Metrics | None = None,
+    ) -> None:
+        """Shared non-blocking HTTP client for outbound API calls, owned by the bot.
+
+        Args:
+            timeout (float, optional): default total timeout per request in seconds. Defaults to 10.
+            pool_size (int, optional): max number of simultaneous connections. Defaults to 100.
+            pool_size_per_host (int, optional): max number of simultaneous connections per host. Defaults to 10.
+            keepalive_timeout (float, optional): seconds to keep idle connections open. Defaults to 30.
+            rate_limiter (RateLimiter, optional): rate limiter waited for per host before requests. Defaults to None.
+            retries (int, optional): max nr of retries per request. Defaults to 2.
+            retry_backoff (float, optional): base of the exponential backoff between retries in seconds.
+                Defaults to 0.5.
+            retry_backoff_max (float, optional): max backoff between retries in seconds. Defaults to 4.
+            failure_threshold (int, optional): consecutive failures of a host until its circuit opens. Defaults to 5.
+            reset_timeout (float, optional): seconds a circuit stays open before a probe request. Defaults to 30.
+            metrics (Metrics, optional): metrics recording the latency per host. Defaults to None.
+        """
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # circuit breaker per host
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.metrics = metrics
+        self.session: aiohttp.ClientSession | None = None
+
+    async def start(self) -> None:
+        """Create the client session and its connection pool, needs to be called from within the event loop"""
+        if self.session is not None and not self.session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            raise_for_status=False,
+        )
+        logger.debug("API client session started (pool: %s, per host: %s)", self.pool_size, self.pool_size_per_host)
+
+    async def close(self) -> None:
+        """Close the client session and release all pooled connections"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            logger.debug("API client session closed")
+        self.session = None
+
+    async def get_json(self, url: str, params: dict | None = None, timeout: float | None = None) -> tuple[int, Any]:
+        """Send a GET request and parse the response body as json
+
+        Args:
+            url (str): request url
+            params (dict, optional): query parameters. Defaults to None.
+            timeout (float, optional): total timeout per attempt in seconds, overrides the client default.
+                Defaults to None.
+
+        Raises:
+            RuntimeError: if the client session has not been started
+            aiohttp.ClientError: if the request fails, CircuitOpenError if the circuit of the host is open
+            TimeoutError: if the request exceeds the timeout or the rate limit of the host
+
+        Returns:
+            tuple: http status code, parsed json body or None if the body is not valid json
+        """
+
+        async def read(response: aiohttp.ClientResponse) -> Any:
+            try:
+                return await response.json(content_type=None)
+            except ValueError:
+                logger.warning("Response from %s is not valid json (status %s)", url, response.status)
+                return None
+
+        return await self._get(url, read, params=params, timeout=timeout)
+
+    async def get_bytes(
+        self, url: str, timeout: float | None = None, max_size: int | None = None
+    ) -> tuple[int, bytes | None]:
+        """Send a GET request and stream the response body into memory
+
+        Args:
+            url (str): request url
+            timeout (float, optional): total timeout per attempt in seconds, overrides the client default.
+                Defaults to None.
+            max_size (int, optional): max body size in bytes, larger bodies are not read. Defaults to None.
+
+        Raises:
+            RuntimeError: if the client session has not been started
+            aiohttp.ClientError: if the request fails, CircuitOpenError if the circuit of the host is open
+            TimeoutError: if the request exceeds the timeout or the rate limit of the host
+
+        Returns:
+            tuple: http status code, body or None if the body exceeds max_size
+        """
+
+        async def read(response: aiohttp.ClientResponse) -> bytes | None:
+            buffer = io.BytesIO()
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                buffer.write(chunk)
+                if max_size is not None and buffer.tell() > max_size:
+                    logger.warning("Response from %s exceeds %s bytes (status %s)", url, max_size, response.status)
+                    return None
+            return buffer.getvalue()
+
+        return await self._get(url, read, timeout=timeout)
+
+    async def _get(
+        self,
+        url: str,
+        read: Callable[[aiohttp.ClientResponse], Awaitable[Any]],
+        params: dict | None = None,
+        timeout: float | None = None,
+    ) -> tuple[int, Any]:
+        """Send a GET request through the circuit breaker of its host, retrying connection errors, timeouts and
+        retryable status codes with exponential backoff and full jitter. GET requests are idempotent, so retries
+        are safe.
+
+        Args:
+            url (str): request url
+            read (Callable): coroutine function reading the body of the response
+            params (dict, optional): query parameters. Defaults to None.
+            timeout (float, optional): total timeout per attempt in seconds. Defaults to None.
+
+        Returns:
+            tuple: http status code, body as returned by read
+        """
+        if self.session is None or self.session.closed:
+            raise RuntimeError("API client session not started.")
+
+        host = urlsplit(url).hostname or ""
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+            self.breakers[host] = breaker
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout is not None else {}
+
+        for attempt in range(self.retries + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(host, breaker.retry_after())
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_url(url)
+
+            start = time.perf_counter()
+            try:
+                async with self.session.get(url, params=params, **kwargs) as response:
+                    status = response.status
+                    retry = status in RETRY_STATUSES and attempt < self.retries
+                    body = None if retry else await read(response)
+            except (aiohttp.ClientError, TimeoutError) as error:
+                self._observe(host, start, error=True)
+                breaker.record_failure()
+                if attempt == self.retries:
+                    raise
+                logger.warning("Request to %s failed: %r, retrying.", host, error)
+            else:
+                self._observe(host, start, error=status >= 500)
+                if status not in RETRY_STATUSES:
+                    breaker.record_success()
+                elif status != 429:
+                    # rate limited responses do not mean the upstream is down
+                    breaker.record_failure()
+                if not retry:
+                    return status, body
+                logger.warning("Response from %s with status %s, retrying.", host, status)
+
+            await asyncio.sleep(random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2**attempt)))
+
+        raise RuntimeError("Unreachable: retry loop exited without result.")
+
+    def _observe(self, host: str, start: float, error: bool) -> None:
+        """Record the latency of a request attempt, including reading its body"""
+        if self.metrics is not None:
+            self.metrics.observe("upstream", host, time.perf_counter() - start, error=error)
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float, max_size: int = 256, stale_ttl: float = 0) -> None:
+        """In-process LRU cache with time to live, stale-while-revalidate and coalescing of concurrent fetches
+
+        Args:
+            name (str): cache name used in logs and stats
+            ttl (float): seconds an entry is served as fresh
+            max_size (int, optional): max nr of entries before least recently used are evicted. Defaults to 256.
+            stale_ttl (float, optional): seconds after ttl an entry is still served while it is refreshed in the
+                background. Defaults to 0.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale_ttl = stale_ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _age(self, key: Hashable) -> float | None:
+        """Get age of an entry in seconds, None if not cached"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[1]
+
+    def get(self, key: Hashable) -> Any | None:
+        """Get a fresh entry without fetching
+
+        Args:
+            key (Hashable): cache key
+
+        Returns:
+            cached value or None if not cached or expired
+        """
+        age = self._age(key)
+        if age is None or age > self.ttl:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def get_stale(self, key: Hashable) -> tuple[Any, float] | None:
+        """Get an entry regardless of its age, e.g. to serve it while its upstream is unavailable
+
+        Args:
+            key (Hashable): cache key
+
+        Returns:
+            tuple: cached value and its age in seconds, None if not cached
+        """
+        age = self._age(key)
+        if age is None:
+            return None
+        self.stale_hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0], age
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Add or replace an entry and evict least recently used entries above max size
+
+        Args:
+            key (Hashable): cache key
+            value (Any): value to cache
+        """
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Get an entry from cache or fetch it on a miss. Stale entries are served while one background
+        refresh runs. Concurrent misses for a key share a single fetch. Fetch results of None are not cached.
+
+        Args:
+            key (Hashable): cache key
+            fetch (Callable): coroutine function without arguments returning the value for key
+
+        Returns:
+            cached or fetched value
+        """
+        age = self._age(key)
+
+        if age is not None and age <= self.ttl:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        if age is not None and age <= self.ttl + self.stale_ttl:
+            self.stale_hits += 1
+            self._entries.move_to_end(key)
+            if key not in self._inflight:
+                self._start_fetch(key, fetch).add_done_callback(self._log_refresh_error)
+            return self._entries[key][0]
+
+        self.misses += 1
+        if key in self._inflight:
+            self.coalesced += 1
+            task = self._inflight[key]
+        else:
+            task = self._start_fetch(key, fetch)
+            task.add_done_callback(self._consume_error)
+        # shield the shared fetch, so a cancelled caller does not cancel it for other callers
+        return await asyncio.shield(task)
+
+    def _start_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Start a fetch for key that concurrent callers can await"""
+        task = asyncio.create_task(self._fetch(key, fetch))
+        self._inflight[key] = task
+        return task
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Fetch a value and cache it, keeping a stale value if the fetch fails"""
+        try:
+            value = await fetch()
+            if value is not None:
+                self.set(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    @staticmethod
+    def _consume_error(task: asyncio.Task) -> None:
+        """Retrieve the error of a shared fetch, which is raised to its callers but unretrieved if all of them were
+        cancelled"""
+        if not task.cancelled():
+            task.exception()
+
+    def _log_refresh_error(self, task: asyncio.Task) -> None:
+        """Log errors of background refreshes, which have no caller awaiting them"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Cache %s: background refresh failed: %r", self.name, task.exception())
+
+    def stats(self) -> dict:
+        """Get cache counters
+
+        Returns:
+            dict: size, hits, stale hits, misses, coalesced misses, evictions and hit ratio
+        """
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,88 @@
+import logging
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    def __init__(self, name: str, retry_after: float) -> None:
+        """Raised instead of sending a request while the circuit of its upstream is open
+
+        Args:
+            name (str): upstream name
+            retry_after (float): seconds until the circuit lets a probe request through
+        """
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Circuit of {name} is open, retry after {retry_after:.1f}s")
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        """Circuit breaker of an upstream. After failure_threshold consecutive failures the circuit opens and
+        requests fail fast. Once reset_timeout passed, a single probe request is let through (half-open), which
+        closes the circuit on success and opens it again on failure.
+
+        Args:
+            name (str): upstream name used in logs
+            failure_threshold (int, optional): consecutive failures until the circuit opens. Defaults to 5.
+            reset_timeout (float, optional): seconds the circuit stays open before probing. Defaults to 30.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        # start of the running probe request, a probe without result is replaced after reset_timeout
+        self.probe_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        """Check if a request may be sent, starting the probe if the circuit is half-open
+
+        Returns:
+            bool: True if the request may be sent
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open":
+            return False
+
+        now = time.monotonic()
+        if self.probe_at is None or now - self.probe_at >= self.reset_timeout:
+            self.probe_at = now
+            logger.info("Circuit of %s is half-open, sending probe request.", self.name)
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Get seconds until the circuit lets a probe request through"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("Circuit of %s closed.", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        # a failed probe opens the circuit again
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning("Circuit of %s opened after %s failures.", self.name, self.failures)
+            self.opened_at = time.monotonic()
+            self.probe_at = None
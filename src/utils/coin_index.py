@@ -0,0 +1,246 @@
+import bisect
+import json
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def trigrams(text: str) -> set:
+    """Splits a text into its set of character trigrams, padded to also match word starts
+
+    Args:
+        text (str): text to split
+
+    Returns:
+        set: trigrams of the text
+    """
+    padded = f"  {text.lower()} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class CoinIndex:
+    def __init__(self, coins: list | None = None) -> None:
+        """Local index of the coingecko coin catalogue with exact, prefix and fuzzy lookup
+
+        Args:
+            coins (list, optional): coins as returned by the coingecko /coins/list endpoint, i.e. dicts with
+                id, symbol and name. Defaults to None.
+        """
+        self.coins: list[dict] = []
+        self._by_id: dict[str, int] = {}
+        self._by_symbol: dict[str, int] = {}
+        self._by_name: dict[str, int] = {}
+        self._prefix_keys: list[tuple[str, int]] = []
+        self._trigrams: dict[str, list[int]] = {}
+        self._trigram_counts: list[int] = []
+
+        if coins:
+            self.build(coins)
+
+    def __len__(self) -> int:
+        return len(self.coins)
+
+    def build(self, coins: list) -> None:
+        """Builds lookup tables for a coin catalogue
+
+        Args:
+            coins (list): coins as returned by the coingecko /coins/list endpoint
+        """
+        self.coins = [
+            {"id": coin["id"], "symbol": coin["symbol"], "name": coin["name"]}
+            for coin in coins
+            if coin.get("id") and coin.get("symbol") and coin.get("name")
+        ]
+
+        self._by_id = {}
+        self._by_symbol = {}
+        self._by_name = {}
+        prefix_keys = set()
+        self._trigrams = {}
+        self._trigram_counts = []
+
+        for idx, coin in enumerate(self.coins):
+            coin_id, symbol, name = coin["id"].lower(), coin["symbol"].lower(), coin["name"].lower()
+
+            self._by_id[coin_id] = idx
+            # symbols and names are not unique, prefer the main coin over wrapped or bridged variants
+            if symbol not in self._by_symbol or self._is_preferred(idx, self._by_symbol[symbol]):
+                self._by_symbol[symbol] = idx
+            if name not in self._by_name or self._is_preferred(idx, self._by_name[name]):
+                self._by_name[name] = idx
+
+            prefix_keys.update([(coin_id, idx), (symbol, idx), (name, idx)])
+            coin_trigrams = trigrams(name) | trigrams(coin_id)
+            for trigram in coin_trigrams:
+                self._trigrams.setdefault(trigram, []).append(idx)
+            self._trigram_counts.append(len(coin_trigrams))
+
+        self._prefix_keys = sorted(prefix_keys)
+        logger.info("Coin index built with %s coins", len(self.coins))
+
+    def _is_preferred(self, idx: int, other_idx: int) -> bool:
+        """Checks if a coin is preferred over another coin sharing its symbol or name
+
+        Args:
+            idx (int): index of the candidate coin
+            other_idx (int): index of the currently indexed coin
+
+        Returns:
+            bool: True if the candidate coin is preferred
+        """
+
+        def rank(i: int) -> tuple:
+            coin = self.coins[i]
+            is_canonical = coin["id"] == coin["name"].lower().replace(" ", "-")
+            return (not is_canonical, len(coin["id"]))
+
+        return rank(idx) < rank(other_idx)
+
+    def get(self, coin_id: str) -> dict | None:
+        """Gets a coin by its coingecko id
+
+        Args:
+            coin_id (str): coingecko coin id
+
+        Returns:
+            dict: coin with id, symbol and name, None if not indexed
+        """
+        idx = self._by_id.get(coin_id.lower())
+        return self.coins[idx] if idx is not None else None
+
+    def lookup(self, query: str) -> str | None:
+        """Exact lookup of a coin by id, symbol or name
+
+        Args:
+            query (str): coin id, symbol or name
+
+        Returns:
+            str: coingecko coin id, None if there is no exact match
+        """
+        key = query.strip().lower()
+        for table in (self._by_id, self._by_symbol, self._by_name):
+            idx = table.get(key)
+            if idx is not None:
+                return self.coins[idx]["id"]
+        return None
+
+    def resolve(self, query: str, min_score: float = 0.5) -> str | None:
+        """Resolves user input to a coin id, using exact lookup first and fuzzy matching as fallback
+
+        Args:
+            query (str): user input, e.g. 'btc', 'Bitcoin' or 'bitcon'
+            min_score (float, optional): min trigram similarity for a fuzzy match. Defaults to 0.5.
+
+        Returns:
+            str: coingecko coin id, None if no coin matches
+        """
+        coin_id = self.lookup(query)
+        if coin_id is not None:
+            return coin_id
+
+        matches = self.fuzzy(query, limit=1)
+        if matches and matches[0][1] >= min_score:
+            return self.coins[matches[0][0]]["id"]
+        return None
+
+    def prefix(self, query: str, limit: int = 25) -> list:
+        """Finds coins with an id, symbol or name starting with the query
+
+        Args:
+            query (str): prefix to search for
+            limit (int, optional): max nr of coins to return. Defaults to 25.
+
+        Returns:
+            list: coin indices, shortest matching keys first
+        """
+        key = query.strip().lower()
+        if not key:
+            return []
+
+        start = bisect.bisect_left(self._prefix_keys, (key, -1))
+        matches: dict[int, int] = {}
+        for i in range(start, len(self._prefix_keys)):
+            prefix_key, idx = self._prefix_keys[i]
+            if not prefix_key.startswith(key):
+                break
+            matches[idx] = min(matches.get(idx, len(prefix_key)), len(prefix_key))
+            # bound the scan for very short prefixes shared by thousands of coins
+            if len(matches) >= limit * 20:
+                break
+
+        return sorted(matches, key=lambda idx: (matches[idx], len(self.coins[idx]["id"])))[:limit]
+
+    def fuzzy(self, query: str, limit: int = 25) -> list:
+        """Finds coins with a name or id similar to the query by trigram similarity
+
+        Args:
+            query (str): text to search for
+            limit (int, optional): max nr of coins to return. Defaults to 25.
+
+        Returns:
+            list: tuples of coin index and similarity score between 0 and 1, best matches first
+        """
+        query_trigrams = trigrams(query.strip())
+        if not query_trigrams:
+            return []
+
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+
+        scored = []
+        for idx, n_shared in shared.most_common(limit * 10):
+            n_union = len(query_trigrams) + self._trigram_counts[idx] - n_shared
+            scored.append((idx, n_shared / n_union))
+
+        return sorted(scored, key=lambda match: match[1], reverse=True)[:limit]
+
+    def suggest(self, query: str, limit: int = 25) -> list:
+        """Suggests coins for user input, exact matches first, then prefix and fuzzy matches
+
+        Args:
+            query (str): user input
+            limit (int, optional): max nr of coins to return. Defaults to 25.
+
+        Returns:
+            list: coins with id, symbol and name
+        """
+        indices: list[int] = []
+
+        exact = self.lookup(query)
+        if exact is not None:
+            indices.append(self._by_id[exact.lower()])
+        for idx in self.prefix(query, limit=limit):
+            if idx not in indices:
+                indices.append(idx)
+        if len(indices) < limit:
+            for idx, _ in self.fuzzy(query, limit=limit):
+                if idx not in indices:
+                    indices.append(idx)
+
+        return [self.coins[idx] for idx in indices[:limit]]
+
+    def save(self, file_path: str) -> None:
+        """Persists the coin catalogue to a json file
+
+        Args:
+            file_path (str): path to the json file
+        """
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(self.coins, f)
+        logger.debug("Coin index saved to %s", file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> "CoinIndex":
+        """Loads a coin catalogue from a json file and builds the index
+
+        Args:
+            file_path (str): path to the json file
+
+        Returns:
+            CoinIndex: index of the persisted coin catalogue
+        """
+        with open(file_path, encoding="utf-8") as f:
+            coins = json.load(f)
+        return cls(coins)
@@ -1,7 +1,11 @@
 import logging
 import math
+import time
 
 import discord
+from discord import app_commands
+
+from utils.setup import command_name as current_command, correlation_id
 
 
 def millify(n: float) -> str:
@@ -43,8 +47,20 @@ def up_down_emoji(_value: float) -> str:
         return ":arrow_right:"
 
 
+def estimate_tokens(text: str) -> int:
+    """Estimates the nr of model tokens of a text, using the common approximation of ~4 characters per token
+
+    Args:
+        text (str): text to estimate tokens for
+
+    Returns:
+        int: estimated nr of tokens
+    """
+    return (len(text) + 3) // 4
+
+
 def extract_command_name(ctx: discord.Interaction, logger: logging.Logger):
-    """Extracts invoked command name and logs command
+    """Extracts invoked command name, sets the interaction id as correlation id of the command's logs and logs command
 
     Args:
         ctx (discord.Interaction): discord context
@@ -54,9 +70,41 @@ def extract_command_name(ctx: discord.Interaction, logger: logging.Logger):
         str: invoked command name
     """
     command_name = ctx.command.name if ctx.command else "unknwon"
-    logger.info(f"_{command_name}_ invoked by _{ctx.user}_ in _{ctx.channel}_ of _{ctx.guild}_")
+    correlation_id.set(str(ctx.id))
+    current_command.set(command_name)
+    logger.info(
+        "_%s_ invoked by _%s_ in _%s_ of _%s_", command_name, ctx.user, ctx.channel, ctx.guild,
+        extra={"command": command_name, "user_id": ctx.user.id, "guild_id": ctx.guild_id},
+    )
+    # start of the command for latency metrics, error handlers call this again
+    ctx.extras.setdefault("started", time.perf_counter())
 
     if command_name == "Unknown":
         logger.error("Unknown command invoked")
 
-    return command_name
\ No newline at end of file
+    return command_name
+
+
+def record_command_latency(ctx: discord.Interaction, error: bool = False) -> None:
+    """Records the latency of a finished command in the bot's metrics, from its call of extract_command_name
+
+    Args:
+        ctx (discord.Interaction): discord context
+        error (bool, optional): whether the command failed. Defaults to False.
+    """
+    started = ctx.extras.get("started")
+    if started is None or ctx.command is None:
+        return
+    ctx.client.metrics.observe("command", ctx.command.name, time.perf_counter() - started, error=error)  # type: ignore
+
+
+def is_bot_owner():
+    """App command check restricting a command to the bot owner
+
+    Returns:
+        Callable: app command check decorator
+    """
+    async def predicate(ctx: discord.Interaction) -> bool:
+        return str(ctx.user.id) == str(ctx.client.KEYS["BOT_OWNER_ID"])  # type: ignore
+
+    return app_commands.check(predicate)
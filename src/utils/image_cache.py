@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        """Size-bounded on-disk cache of generated images, each stored in a file named after the hash of its key.
+        Least recently used images are evicted once the cache exceeds max_bytes. Blocking file I/O, so methods are
+        meant to run in a thread, and thread-safe, as several image jobs use the cache at once.
+
+        Args:
+            cache_dir (str): directory of the cached images
+            max_bytes (int): max total size of the cached images in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # size per cached file, filled on first use from the files on disk, guarded by the lock
+        self._sizes: dict[str, int] | None = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(prompt: str, model: str, size: str) -> str:
+        """Create the cache key of an image
+
+        Args:
+            prompt (str): image description, case and whitespace are ignored
+            model (str): image model
+            size (str): image size, e.g. "1024x1024"
+
+        Returns:
+            str: hex digest identifying the image
+        """
+        normalized_prompt = " ".join(prompt.split()).casefold()
+        return hashlib.sha256(f"{model}\0{size}\0{normalized_prompt}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def _load_sizes(self) -> dict[str, int]:
+        """Get sizes of the cached files, scanning the cache dir once, needs to be called with the lock held"""
+        if self._sizes is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._sizes = {
+                entry.path: entry.stat().st_size
+                for entry in os.scandir(self.cache_dir)
+                if entry.is_file() and entry.name.endswith(".png")
+            }
+        return self._sizes
+
+    def get(self, key: str) -> bytes | None:
+        """Get a cached image
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            bytes: image, None if not cached
+        """
+        path = self._path(key)
+        with self._lock:
+            if path not in self._load_sizes():
+                self.misses += 1
+                return None
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # modification time tracks recent use for eviction
+            os.utime(path)
+        except OSError as e:
+            # evicted by another thread since the lookup, or removed from disk
+            if isinstance(e, FileNotFoundError):
+                logger.debug("Cached image %s evicted before it was read.", key)
+            else:
+                logger.error("Cached image %s not read: %r", key, e)
+            with self._lock:
+                self._load_sizes().pop(path, None)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        """Add an image to the cache and evict least recently used images above max_bytes
+
+        Args:
+            key (str): cache key
+            data (bytes): image
+        """
+        path = self._path(key)
+        with self._lock:
+            self._load_sizes()
+
+        # write to a temporary file first, so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            logger.error("Image %s not cached: %r", key, e)
+            os.remove(tmp_path)
+            return
+
+        with self._lock:
+            sizes = self._load_sizes()
+            try:
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.error("Image %s not cached: %r", key, e)
+                os.remove(tmp_path)
+                return
+            sizes[path] = len(data)
+
+            total = sum(sizes.values())
+            if total <= self.max_bytes:
+                return
+
+            for old_path in sorted(sizes, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0):
+                if total <= self.max_bytes:
+                    break
+                if old_path == path:
+                    continue
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+                total -= sizes.pop(old_path)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Get cache counters
+
+        Returns:
+            dict: nr of cached images, their size in bytes, hits, misses, evictions and hit ratio
+        """
+        with self._lock:
+            sizes = dict(self._sizes or {})
+        lookups = self.hits + self.misses
+        return {
+            "size": len(sizes),
+            "bytes": sum(sizes.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,241 @@
+import asyncio
+import contextvars
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, owner: Hashable, func: Callable[[], Awaitable[Any]], deadline: float) -> None:
+        """Job of a FairJobQueue, awaitable through its future. Runs in a copy of the context it was created in, so
+        its logs keep the correlation id of the submitting command.
+
+        Args:
+            owner (Hashable): owner of the job, e.g. a user id, jobs are scheduled round-robin across owners
+            func (Callable): coroutine function without arguments running the job
+            deadline (float): loop time after which the job is cancelled, queued or running
+        """
+        self.owner = owner
+        self.func = func
+        self.deadline = deadline
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: asyncio.Task | None = None
+        self.context = contextvars.copy_context()
+        # timer expiring the job at its deadline while it is still queued
+        self.expiry: asyncio.TimerHandle | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+
+class FairJobQueue:
+    def __init__(self, name: str, concurrency: int = 2, max_jobs_per_owner: int = 3) -> None:
+        """Job queue running at most concurrency jobs at once. Owners take turns, so one owner with many queued jobs
+        does not hold up others. Jobs past their deadline are cancelled.
+
+        Args:
+            name (str): queue name used in logs and stats
+            concurrency (int, optional): max nr of jobs running at once. Defaults to 2.
+            max_jobs_per_owner (int, optional): max nr of queued and running jobs per owner. Defaults to 3.
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.max_jobs_per_owner = max_jobs_per_owner
+        # queued jobs per owner, owners in turn order, an owner moves to the end once a job of theirs starts
+        self._queues: OrderedDict[Hashable, deque[Job]] = OrderedDict()
+        self._running: set[Job] = set()
+        self._jobs_per_owner: dict[Hashable, int] = {}
+        self._not_empty = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+
+    def start(self) -> None:
+        """Start the workers, needs to be called from within the event loop"""
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def close(self) -> None:
+        """Stop the workers and cancel all queued and running jobs"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._queues.values():
+            for job in queue:
+                if job.expiry is not None:
+                    job.expiry.cancel()
+                job.future.cancel()
+        self._queues.clear()
+        self._jobs_per_owner.clear()
+
+    def submit(self, owner: Hashable, func: Callable[[], Awaitable[Any]], timeout: float) -> Job | None:
+        """Queue a job
+
+        Args:
+            owner (Hashable): owner of the job
+            func (Callable): coroutine function without arguments running the job
+            timeout (float): seconds after which the job is cancelled, queued or running
+
+        Returns:
+            Job: queued job, None if the owner has max_jobs_per_owner jobs already
+        """
+        if self._jobs_per_owner.get(owner, 0) >= self.max_jobs_per_owner:
+            return None
+
+        loop = asyncio.get_running_loop()
+        job = Job(owner=owner, func=func, deadline=loop.time() + timeout)
+        # a queued job expires at its deadline, not only once a worker pops it, so its owner's slot is released
+        job.expiry = loop.call_at(job.deadline, self._expire, job)
+        self._queues.setdefault(owner, deque()).append(job)
+        self._jobs_per_owner[owner] = self._jobs_per_owner.get(owner, 0) + 1
+        self._not_empty.set()
+        return job
+
+    def cancel(self, job: Job) -> None:
+        """Cancel a queued or running job
+
+        Args:
+            job (Job): job to cancel
+        """
+        if job.task is not None:
+            job.task.cancel()
+            return
+
+        self._remove_queued(job)
+        job.future.cancel()
+
+    def _remove_queued(self, job: Job) -> bool:
+        """Remove a queued job and release its owner's slot
+
+        Returns:
+            bool: True if the job was queued
+        """
+        queue = self._queues.get(job.owner)
+        if queue is None or job not in queue:
+            return False
+        queue.remove(job)
+        if not queue:
+            del self._queues[job.owner]
+        if not self._queues:
+            self._not_empty.clear()
+        self._finish(job)
+        return True
+
+    def _expire(self, job: Job) -> None:
+        """Cancel a job still queued at its deadline, runs as timer callback"""
+        if self._remove_queued(job):
+            self.expired += 1
+            job.future.cancel()
+            logger.info("Job queue %s: job of %s expired while queued.", self.name, job.owner)
+
+    def position(self, job: Job) -> int:
+        """Get the position of a queued job in the turn order
+
+        Args:
+            job (Job): queued job
+
+        Returns:
+            int: 1 if the job starts next, 0 if it is running or done
+        """
+        queue = self._queues.get(job.owner)
+        if job.running or job.future.done() or queue is None or job not in queue:
+            return 0
+
+        # the job starts in its owner's (index + 1)-th turn, every owner ahead in the turn order gets as many turns
+        # and every owner behind one turn less
+        index = queue.index(job)
+        position = index + 1
+        ahead = True
+        for owner, other_queue in self._queues.items():
+            if owner == job.owner:
+                ahead = False
+                continue
+            position += min(len(other_queue), index + 1 if ahead else index)
+        return position
+
+    def _next_job(self) -> Job:
+        """Pop the first job of the owner whose turn it is"""
+        owner, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            self._queues.move_to_end(owner)
+        else:
+            del self._queues[owner]
+        if not self._queues:
+            self._not_empty.clear()
+        return job
+
+    def _finish(self, job: Job) -> None:
+        """Release the slot of the job's owner"""
+        if job.expiry is not None:
+            job.expiry.cancel()
+        remaining = self._jobs_per_owner.get(job.owner, 0) - 1
+        if remaining > 0:
+            self._jobs_per_owner[job.owner] = remaining
+        else:
+            self._jobs_per_owner.pop(job.owner, None)
+
+    async def _worker(self) -> None:
+        """Run queued jobs one at a time"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self._not_empty.wait()
+            if not self._queues:
+                self._not_empty.clear()
+                continue
+            job = self._next_job()
+
+            remaining = job.deadline - loop.time()
+            if remaining <= 0:
+                self.expired += 1
+                self._finish(job)
+                job.future.cancel()
+                logger.info("Job queue %s: job of %s expired while queued.", self.name, job.owner)
+                continue
+
+            job.task = asyncio.create_task(job.func(), context=job.context)
+            self._running.add(job)
+            try:
+                # jobs are cancelled once their deadline is reached, awaiting the job task cancels it along
+                async with asyncio.timeout_at(job.deadline):
+                    result = await job.task
+                if not job.future.done():
+                    job.future.set_result(result)
+                self.completed += 1
+            except TimeoutError:
+                self.expired += 1
+                job.future.cancel()
+                logger.info("Job queue %s: job of %s expired while running.", self.name, job.owner)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                # stop if the worker itself is cancelled, rather than only the job
+                if asyncio.current_task().cancelling():  # type: ignore
+                    raise
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._running.discard(job)
+                self._finish(job)
+
+    def stats(self) -> dict:
+        """Get queue counters
+
+        Returns:
+            dict: nr of queued, running, completed, failed and expired jobs
+        """
+        return {
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired,
+        }
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Awaitable, Callable
+
+from utils.setup import command_name, correlation_id
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.5,
+        threshold: float = 0.25,
+        alert_after: float = 30,
+        alert_cooldown: float = 3600,
+        on_alert: Callable[[str], Awaitable[None]] | None = None,
+    ) -> None:
+        """Watchdog of the event loop. A task measures how late the loop wakes it up (scheduling lag) and a thread
+        captures the stack and command of callbacks blocking the loop longer than the threshold, while they block.
+        If the lag stays above the threshold for alert_after seconds, on_alert is called.
+
+        Args:
+            interval (float, optional): seconds between lag measurements. Defaults to 0.5.
+            threshold (float, optional): lag in seconds above which the loop counts as blocked. Defaults to 0.25.
+            alert_after (float, optional): seconds the lag needs to stay above the threshold to alert. Defaults to 30.
+            alert_cooldown (float, optional): min seconds between alerts. Defaults to 3600.
+            on_alert (Callable, optional): coroutine function called with an alert message. Defaults to None.
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.alert_after = alert_after
+        self.alert_cooldown = alert_cooldown
+        self.on_alert = on_alert
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        # alert being sent, kept so it is not garbage collected and can be cancelled on close
+        self._alert_task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        # monotonic time the loop last ran the monitor task, read by the watchdog thread
+        self._heartbeat = time.monotonic()
+        # start of the current period of lag above the threshold and time of the last alert
+        self._lag_since: float | None = None
+        self._alerted_at: float | None = None
+
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.slow = 0
+        self.stalls = 0
+
+    def start(self) -> None:
+        """Start the monitor task and watchdog thread, needs to be called from within the event loop"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._monitor())
+        self._thread = threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.debug("Event loop monitor started (interval: %.2fs, threshold: %.2fs)", self.interval, self.threshold)
+
+    async def close(self) -> None:
+        """Stop the monitor task and watchdog thread"""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._alert_task is not None:
+            self._alert_task.cancel()
+            await asyncio.gather(self._alert_task, return_exceptions=True)
+            self._alert_task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    async def _monitor(self) -> None:
+        """Measure the scheduling lag every interval and alert on lag above the threshold for alert_after seconds"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag <= self.threshold:
+                if self._lag_since is not None and self._alerted_at is not None and self._alerted_at >= self._lag_since:
+                    logger.info("Event loop lag back below %.2fs after %.0fs.", self.threshold, now - self._lag_since)
+                self._lag_since = None
+                continue
+
+            self.slow += 1
+            logger.debug("Event loop lag of %.3fs.", lag)
+            # the loop fell behind when this tick was due, not when it ran
+            if self._lag_since is None:
+                self._lag_since = now - lag
+            if now - self._lag_since < self.alert_after:
+                continue
+            if self._alerted_at is not None and now - self._alerted_at < self.alert_cooldown:
+                continue
+
+            self._alerted_at = now
+            message = (
+                f"Event loop lag above {self.threshold:.2f}s for {now - self._lag_since:.0f}s "
+                f"(last: {lag:.2f}s, max: {self.max_lag:.2f}s), heartbeats may be missed."
+            )
+            logger.warning(message)
+            # send the alert in its own task, a slow alert must not delay the heartbeat and look like a stall
+            if self.on_alert is not None and (self._alert_task is None or self._alert_task.done()):
+                self._alert_task = asyncio.create_task(self.on_alert(message))
+                self._alert_task.add_done_callback(self._log_alert_error)
+
+    @staticmethod
+    def _log_alert_error(task: asyncio.Task) -> None:
+        """Log an alert that was not sent, runs as done callback of the alert task"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Event loop lag alert not sent: %r", task.exception())
+
+    def _watchdog(self) -> None:
+        """Capture the stack of the loop thread once per stall, runs on the watchdog thread"""
+        captured = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked <= self.threshold or heartbeat == captured:
+                continue
+            captured = heartbeat
+            self.stalls += 1
+            self._log_stall(blocked)
+
+    def _log_stall(self, blocked: float) -> None:
+        """Log the stack of the loop thread and the command of the task it is running"""
+        frame = sys._current_frames().get(self._loop_thread_id)  # type: ignore
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "unknown"
+
+        # reading the current task of another thread's loop is racy, but only used for the log
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        context = task.get_context() if task is not None else None
+        command = context.get(command_name, "-") if context is not None else "-"
+        interaction_id = context.get(correlation_id, "-") if context is not None else "-"
+
+        logger.warning(
+            "Event loop blocked for more than %.2fs in command %s, stack of the loop thread:\n%s",
+            blocked, command, stack,
+            extra={"correlation_id": interaction_id, "command": command, "blocked": round(blocked, 3)},
+        )
+
+    def stats(self) -> dict:
+        """Get monitor counters
+
+        Returns:
+            dict: last and max lag in seconds, nr of slow measurements and captured stalls
+        """
+        return {
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "slow": self.slow,
+            "stalls": self.stalls,
+        }
@@ -0,0 +1,165 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency histogram buckets in seconds, the last bucket takes everything above
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        """Latency histogram with fixed buckets, so memory does not grow with the nr of observations
+
+        Args:
+            buckets (tuple, optional): sorted upper bounds of the buckets in seconds. Defaults to LATENCY_BUCKETS.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile, interpolating linearly within its bucket
+
+        Args:
+            q (float): quantile between 0 and 1, e.g. 0.95
+
+        Returns:
+            float: estimated latency in seconds, 0 without observations
+        """
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                # observations above the last bound are reported as the last bound
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    def __init__(self) -> None:
+        """In-memory latency histograms and error counts per command and per upstream, owned by the bot"""
+        self.histograms: dict[str, dict[str, Histogram]] = {"command": {}, "upstream": {}}
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False) -> None:
+        """Record the latency of a command or upstream call
+
+        Args:
+            kind (str): "command" or "upstream"
+            name (str): command or upstream name
+            seconds (float): latency in seconds
+            error (bool, optional): whether the call failed. Defaults to False.
+        """
+        histogram = self.histograms[kind].get(name)
+        if histogram is None:
+            histogram = self.histograms[kind][name] = Histogram()
+        histogram.observe(seconds, error=error)
+
+    @contextmanager
+    def timer(self, kind: str, name: str) -> Iterator[None]:
+        """Context manager recording the latency of its block, which counts as error if it raises
+
+        Args:
+            kind (str): "command" or "upstream"
+            name (str): command or upstream name
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(kind, name, time.perf_counter() - start, error=error)
+
+    def summary(self, kind: str) -> list:
+        """Get count, errors and latency quantiles per name
+
+        Args:
+            kind (str): "command" or "upstream"
+
+        Returns:
+            list: tuples of name, count, errors, p50, p95 and p99 in seconds, sorted by name
+        """
+        return [
+            (name, h.count, h.errors, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+            for name, h in sorted(self.histograms[kind].items())
+        ]
+
+    def render_prometheus(self, caches: dict | None = None) -> str:
+        """Render histograms and cache counters in the Prometheus text format
+
+        Args:
+            caches (dict, optional): caches by name with a stats method. Defaults to None.
+
+        Returns:
+            str: metrics in the Prometheus text format
+        """
+        lines = []
+        for kind, histograms in self.histograms.items():
+            metric = f"bot_{kind}_latency_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, h in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{kind}="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{kind}="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{metric}_sum{{{kind}="{name}"}} {h.sum}')
+                lines.append(f'{metric}_count{{{kind}="{name}"}} {h.count}')
+            lines.append(f"# TYPE bot_{kind}_errors_total counter")
+            for name, h in sorted(histograms.items()):
+                lines.append(f'bot_{kind}_errors_total{{{kind}="{name}"}} {h.errors}')
+
+        for counter in ("hits", "stale_hits", "misses", "evictions"):
+            lines.append(f"# TYPE bot_cache_{counter}_total counter")
+            for name, cache in (caches or {}).items():
+                lines.append(f'bot_cache_{counter}_total{{cache="{name}"}} {cache.stats()[counter]}')
+
+        return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(metrics: Metrics, caches: dict, host: str, port: int) -> web.AppRunner:
+    """Serve metrics in the Prometheus text format at /metrics
+
+    Args:
+        metrics (Metrics): metrics to serve
+        caches (dict): caches by name with a stats method
+        host (str): host to listen on, e.g. "127.0.0.1" for local scrapes only
+        port (int): port to listen on
+
+    Returns:
+        web.AppRunner: runner of the server, to be cleaned up on shutdown
+    """
+
+    async def handle_metrics(_: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(caches=caches), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info("Metrics served at http://%s:%s/metrics", host, port)
+    return runner
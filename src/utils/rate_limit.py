@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Hashable
+from urllib.parse import urlsplit
+
+import discord
+from discord import app_commands
+
+logger = logging.getLogger(__name__)
+
+# interactions need a response within 3 seconds, a command waiting for its user's rate limit leaves this much of
+# that time for its defer
+INTERACTION_RESPONSE_TIMEOUT = 3
+INTERACTION_RESPONSE_MARGIN = 1.5
+
+
+class RateLimited(app_commands.CheckFailure):
+    def __init__(self, retry_after: float) -> None:
+        """Raised by the rate_limit check if a user has no request left within the max wait
+
+        Args:
+            retry_after (float): seconds until the user has a request again
+        """
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited, retry after {retry_after:.2f}s")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        """Token bucket allowing bursts of requests and refilling at a constant rate
+
+        Args:
+            rate (float): tokens refilled per second, greater than 0
+            burst (int): max nr of tokens, i.e. requests allowed at once, at least 1
+
+        Raises:
+            ValueError: if rate or burst are out of range
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Token bucket needs a rate > 0 and a burst >= 1, got rate {rate} and burst {burst}.")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait: float) -> float | None:
+        """Take a token, reserving a future one if the bucket is empty. Tokens may go negative, so reservations are
+        served in order.
+
+        Args:
+            max_wait (float): max seconds to wait for a token
+
+        Returns:
+            float: seconds to wait until the reserved token is available, None if that exceeds max_wait
+        """
+        self._refill()
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def retry_after(self) -> float:
+        """Get seconds until the next token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        upstream: dict,
+        user: dict,
+        upstream_max_wait: float = 10,
+        user_max_wait: float = 2,
+        max_users: int = 10000,
+    ) -> None:
+        """Token bucket rate limits per upstream API and per user, owned by the bot
+
+        Args:
+            upstream (dict): rate and burst per upstream, named by host of its urls, e.g. {"api.coingecko.com":
+                {"rate": 0.5, "burst": 5}}
+            user (dict): rate and burst per user across all rate limited commands, e.g. {"rate": 0.2, "burst": 3}
+            upstream_max_wait (float, optional): max seconds a call waits for its upstream. Defaults to 10.
+            user_max_wait (float, optional): max seconds a command waits for its user. Defaults to 2.
+            max_users (int, optional): max nr of user buckets, least recently used are dropped. Defaults to 10000.
+        """
+        self._upstream = {name: TokenBucket(**limits) for name, limits in upstream.items()}
+        self.user_limits = user
+        self.upstream_max_wait = upstream_max_wait
+        self.user_max_wait = user_max_wait
+        self.max_users = max_users
+        self._users: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+        self.waited = 0
+        self.rejected = 0
+
+    async def acquire_upstream(self, name: str, max_wait: float | None = None) -> None:
+        """Wait for a request to an upstream API, upstreams without limit are not waited for
+
+        Args:
+            name (str): upstream name
+            max_wait (float, optional): max seconds to wait, overrides upstream_max_wait. Defaults to None.
+
+        Raises:
+            TimeoutError: if no request is available within max_wait
+        """
+        bucket = self._upstream.get(name)
+        if bucket is None:
+            return
+
+        wait = bucket.reserve(self.upstream_max_wait if max_wait is None else max_wait)
+        if wait is None:
+            self.rejected += 1
+            logger.warning("Rate limit of %s exceeded, request rejected.", name)
+            raise TimeoutError(f"Rate limit of {name} exceeded.")
+        if wait > 0:
+            self.waited += 1
+            logger.debug("Rate limit of %s reached, waiting %.2fs.", name, wait)
+            await asyncio.sleep(wait)
+
+    async def acquire_url(self, url: str) -> None:
+        """Wait for a request to the upstream API of a url, named by its host
+
+        Args:
+            url (str): request url
+
+        Raises:
+            TimeoutError: if no request is available within upstream_max_wait
+        """
+        await self.acquire_upstream(urlsplit(url).hostname or "")
+
+    async def acquire_user(self, user_id: Hashable, max_wait: float | None = None) -> None:
+        """Wait for a request of a user
+
+        Args:
+            user_id (Hashable): user id
+            max_wait (float, optional): max seconds to wait, overrides user_max_wait. Defaults to None.
+
+        Raises:
+            RateLimited: if no request is available within user_max_wait
+        """
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(**self.user_limits)
+            self._users[user_id] = bucket
+            # least recently used buckets are most likely refilled, so dropping them loses little
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+
+        wait = bucket.reserve(self.user_max_wait if max_wait is None else max_wait)
+        if wait is None:
+            self.rejected += 1
+            raise RateLimited(retry_after=bucket.retry_after())
+        if wait > 0:
+            self.waited += 1
+            await asyncio.sleep(wait)
+
+
+def rate_limit():
+    """App command check limiting the requests of a user with the bot's rate limiter, a command waits shortly for
+    the user's next request instead of failing right away, but never so long that it misses its response deadline
+
+    Returns:
+        Callable: app command check decorator
+    """
+    async def predicate(ctx: discord.Interaction) -> bool:
+        rate_limiter = ctx.client.rate_limiter  # type: ignore
+        # clamped, as the interaction is created on discord's clock
+        elapsed = min(max((discord.utils.utcnow() - ctx.created_at).total_seconds(), 0), INTERACTION_RESPONSE_TIMEOUT)
+        max_wait = min(rate_limiter.user_max_wait, INTERACTION_RESPONSE_TIMEOUT - INTERACTION_RESPONSE_MARGIN - elapsed)
+        await rate_limiter.acquire_user(ctx.user.id, max_wait=max(max_wait, 0))
+        return True
+
+    return app_commands.check(predicate)
@@ -1,12 +1,109 @@
+import atexit
+import contextvars
+import copy
+import gzip
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
 
-import discord
 import dotenv
 
+# id of the interaction being handled, set per command task and copied into tasks and threads started from it
+correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar("correlation_id", default="-")
+# name of the command being handled, read by the event loop monitor to name blocking commands
+command_name: contextvars.ContextVar[str] = contextvars.ContextVar("command_name", default="-")
+
+# attributes of every log record, anything else was passed as extra and is added to json logs
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id", "taskName"}
+
+
+class CorrelationIdFilter(logging.Filter):
+    """Log filter adding the correlation id of the current context to records as correlation_id. Needs to run on the
+    thread the record is created on, so it is added to the queue handler rather than the listener's handlers."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # an id passed as extra, e.g. by the loop monitor thread, takes precedence
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = correlation_id.get()
+        return True
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler for a listener in the same process. The default prepare merges the traceback into the message
+    and drops exc_info and stack_info, so formatters of the listener could not render them separately. Records here
+    are never pickled, so only the message is resolved and the exception is formatted by the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # resolve the message now, args may be mutable objects that change before the listener formats the record
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Log formatter writing one json object per record, with time, level, logger, correlation id, message, extra
+    fields and exception"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, name_prefix: str, level: int, every_n: int) -> None:
+        """Log filter keeping only every n-th record of high-volume loggers at or below a level
+
+        Args:
+            name_prefix (str): logger name prefix of sampled records, e.g. "discord.gateway"
+            level (int): records at or below this level are sampled, e.g. logging.DEBUG
+            every_n (int): keep every n-th sampled record, 1 or less keeps all
+        """
+        super().__init__()
+        self.name_prefix = name_prefix
+        self.level = level
+        self.every_n = every_n
+        self.seen = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every_n <= 1 or record.levelno > self.level or not record.name.startswith(self.name_prefix):
+            return True
+        self.seen += 1
+        return self.seen % self.every_n == 1
+
+
+def gzip_namer(name: str) -> str:
+    """Names rotated log files as gzip files"""
+    return name + ".gz"
+
+
+def gzip_rotator(source: str, dest: str) -> None:
+    """Compresses a rotated log file, runs on the log listener thread"""
+    with open(source, "rb") as source_file, gzip.open(dest, "wb") as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
 
 def log_setup(config_params: dict):
-    """Sets up logging for discord bot
+    """Sets up logging for discord bot. Records are queued on the calling thread and formatted and written by a
+    listener thread, so logging never blocks the event loop on disk I/O.
 
     Args:
         config_params (dict): dictionary of config parameters
@@ -16,15 +113,56 @@ def log_setup(config_params: dict):
     """
     log_path = config_params["log_path"]
 
-    # define handler type and formatting
-    handler = logging.FileHandler(filename=log_path, encoding='utf-8', mode='w')
-    formatter = logging.Formatter('%(asctime)s: %(levelname)s :%(name)s - %(message)s')
+    # define handler types and formatting, rotated log files are compressed
+    if config_params["log_rotation"] == "time":
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            filename=log_path,
+            when=config_params["log_rotation_when"],
+            backupCount=config_params["log_backup_count"],
+            encoding="utf-8",
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            filename=log_path,
+            maxBytes=config_params["log_max_mb"] * 1024 * 1024,
+            backupCount=config_params["log_backup_count"],
+            encoding="utf-8",
+        )
+    file_handler.namer = gzip_namer
+    file_handler.rotator = gzip_rotator
+    handlers: list[logging.Handler] = [file_handler]
+    if config_params["log_console"]:
+        handlers.append(logging.StreamHandler())
+
+    # records are formatted as text lines or json objects, both with the correlation id of their interaction
+    if config_params["log_format"] == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s: %(levelname)s :%(name)s - [%(correlation_id)s] %(message)s')
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # queue records and write them on a listener thread, high-volume gateway debug records are sampled and kept
+    # records get the correlation id of the context they are logged in
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(
+        SampleFilter(name_prefix="discord.gateway", level=logging.DEBUG, every_n=config_params["log_gateway_sample"])
+    )
+    queue_handler.addFilter(CorrelationIdFilter())
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # write queued records on shut down
+    atexit.register(listener.stop)
+
+    # include discord lib logging and set levels, per logger levels override the root level
+    root_logger = logging.getLogger()
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(config_params["log_level"])
+    for logger_name, level in config_params["log_levels"].items():
+        logging.getLogger(logger_name).setLevel(level)
 
-    # include discord lib logging and set level
-    discord.utils.setup_logging(handler=handler, formatter=formatter, level=logging.DEBUG)
     logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
-
     return logger
 
 